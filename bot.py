@@ -13,25 +13,40 @@
 # limitations under the License.
 
 #region Python imports
+import time
+process_start_time = time.perf_counter() # Start of the cold start, measured before anything else gets imported
 import os
 import io
+import sys
 import re
 import math
+import glob
+import shutil
 import json
-import copy
-import pytz
-import emoji
+import zlib
+import base64
+import hashlib
+import asyncio
+import aiohttp
 import discord
-import requests
 import traceback
-import statistics
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from datetime import datetime
+import tracemalloc
+import importlib
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource # Only available on Unix, used to report the peak memory usage after loading guild_data
+except ImportError:
+    resource = None
 from dotenv import load_dotenv
 from discord import app_commands
 from discord.ext import commands
 from discord.ui import View, Button
+# Heavy dependencies that only some commands need (numpy, matplotlib and emoji) are imported the first time
+# they're used, see import_deferred_dependencies
 #endregion
 
 #region Initialisation
@@ -39,12 +54,103 @@ from discord.ui import View, Button
 dev_disable_apis = True # Disable connecting to APIs such as bot websites
 dev_active_single_guild = False # Make the bot only active in a certain guild
 dev_mode_guild_id = 574350984495628436 # If the above is true, bot must be in this guild already
-update_guild_data = False # Forces updating of newly added guild_data values after a ChadCounting update
+
+# Catch-up settings
+catch_up_concurrency = 8 # Maximum amount of guilds that catch up on missed counts at the same time
+catch_up_progress_interval = 100 # Print the catch-up progress every time this amount of guilds caught up
+catch_up_reaction_max_age = 3600 # Missed counts older than this amount of seconds get no reactions, None reacts to all
+catch_up_reaction_interval = 0.25 # Seconds between the reactions the background queue adds to missed counts
+
+# Reaction settings
+single_reaction_under_load = True # Only add the first reaction to counts of a guild that counts faster than its reactions can be added
+reaction_backlog_threshold = 3 # Amount of counts of a guild still waiting on their reactions from which on a guild is under load
+
+# Troll prevention settings
+penalize_deleted_counts = False # Ban users who delete their latest count for the troll amount, off as this never ran before
+
+# Average count settings
+average_count_ewma = False # Use an exponentially weighted mean of the previous counts, so recent streaks weigh more in long-lived guilds
+average_count_ewma_alpha = 0.05 # Weight of the newest streak in the exponentially weighted mean
+
+# Previous counts settings
+previous_counts_hot_window = 1000 # Amount of the most recent previous counts of a guild that are kept in memory and in guild_data.json
+previous_counts_cold_directory = "previous_counts" # Directory with the full history of previous counts of every guild
+
+# Startup settings
+preload_deferred_dependencies = True # Import the heavy dependencies in the background once the bot is ready, so their first use isn't slow
+index_build_batch_size = 10000 # Amount of users added to the indexes at start-up before other tasks get to run again
+deferred_dependencies = ("numpy", "matplotlib.figure", "matplotlib.image", "matplotlib.backends.backend_agg", "emoji")
+
+# Bot website API settings
+api_timeout = 10 # Maximum amount of seconds a request to a bot website may take
+api_retries = 3 # Amount of times a failed request to a bot website is retried
+api_retry_backoff = 2 # Seconds before the first retry, doubles on every next retry
+guild_count_push_interval = 300 # Minimum amount of seconds between two pushes of the guild count, a burst of joins results in one push
+
+# Name resolution settings
+user_name_cache_ttl = 3600 # Seconds a resolved user name stays in the cache before it gets resolved again
+user_name_cache_size = 10000 # Maximum amount of user names in the cache, the least recently used name is dropped first
+
+# Banrate chart settings
+banrate_chart_cache_size = 100 # Maximum amount of rendered banrate charts kept in memory, the least recently used chart is dropped first
+
+# Persistence settings
+guild_data_file = "guild_data.json" # Full snapshot of the database
+guild_data_journal_file = "guild_data.journal" # Append-only journal of changed guild and user records
+journal_compaction_ratio = 0.5 # The journal gets compacted into the snapshot once it is this fraction of the size of the snapshot
+journal_compaction_minimum_size = 1024 * 1024 # Bytes the journal can always grow to, so a small database isn't compacted every few counts
+snapshot_backup_amount = 3 # Amount of previous snapshots and journals kept as backups, used when the snapshot is corrupt
+snapshot_batch_size = 10000 # Amount of users copied into a snapshot before the copy lets counts be handled again
+write_behind_latency = 0.25 # Maximum amount of seconds a change waits before it gets flushed to the journal
+snapshot_header_prefix = "#chadcounting" # First line of the snapshot and journal files, holds the checksum and generation
+
+# Sharding settings, the shards a process runs are configured with SHARD_IDS and SHARD_COUNT in the .env file
+shard_summary_directory = "shard_summaries" # Directory shared by all processes of a sharded deployment, holds the summary of every process
+shard_summary_interval = 60 # Seconds between two exchanges of the summaries of the processes
+shard_summary_max_age = 300 # Summaries older than this amount of seconds belong to a stopped process and are ignored
 
 # Initialize variables and load environment tables
 load_dotenv()
 BOT_TOKEN = os.getenv("PROD_TOKEN") # ChadCounting token (either PROD_TOKEN or DEV_TOKEN)
+SHARD_COUNT = os.getenv("SHARD_COUNT") # Total amount of shards over all processes of a sharded deployment
+SHARD_IDS = os.getenv("SHARD_IDS") # Comma-separated IDs of the shards this process runs
+shard_count = int(SHARD_COUNT) if SHARD_COUNT else None # None lets Discord decide the amount of shards
+shard_ids = [int(shard_id) for shard_id in SHARD_IDS.split(",")] if SHARD_IDS else None # None runs all shards in this process
+shard_name = None # Name of the data and summary files of this process in a sharded deployment
+if shard_ids != None: # Every process of a sharded deployment only loads and saves the guilds of its own shards
+    if shard_count == None:
+        raise ValueError("SHARD_COUNT needs to be set if SHARD_IDS is set.")
+    shard_name = "shard" + "-".join(str(shard_id) for shard_id in shard_ids)
+    unsharded_guild_data_files = (guild_data_file, guild_data_journal_file) # Loaded the first time a process starts
+    guild_data_file = f"guild_data.{shard_name}.json"
+    guild_data_journal_file = f"guild_data.{shard_name}.journal"
 guild_data = {} # Global variable for database
+journal_size = 0 # Bytes in the journal, updated by the persistence thread
+snapshot_size = 0 # Bytes in the last written snapshot, updated by the persistence thread
+compaction_task = None # Task of the last compaction, only one compaction runs at a time
+compaction_flushed_guilds = None # Guilds flushed to the old journal while a compaction copies the snapshot, with their user IDs
+guild_data_generation = 0 # Increases on every compaction, the journal is only replayed on a snapshot of the same generation
+dirty_guilds = {} # Guilds with changes that haven't been flushed yet, with the IDs of their changed users
+dirty_guilds_event = asyncio.Event() # Wakes up the write-behind task when a guild gets marked dirty
+persistence_paused_guilds = {} # Guilds in a catch-up replay with a copy of their state before it, their changes are flushed once the replay is complete
+catch_up_reaction_queue = asyncio.Queue() # Reactions to missed counts, added in the background by the reaction task
+guild_locks = {} # Per-guild locks that serialize the counts of a guild
+counting_channels = {} # Counting channel IDs with the IDs of their guilds, lets on_message reject other messages quickly
+message_filter_stats = {"filtered": 0, "processed": 0} # Amount of messages rejected by the fast path and checked as counts
+last_checked_message_ids = {} # Per-guild ID of the newest checked counting message, so no message is checked twice
+persistence_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence") # Dedicated writer thread
+persistence_metrics = {"flushes": 0, "loop_seconds": 0.0, "writer_seconds": 0.0} # Time persistence costs
+archiving_guilds = set() # Guilds whose oldest previous counts are being written to their cold history file
+pending_reactions = {} # Per-guild amount of counts whose reactions are still being added, used to detect load
+resolved_reactions = {} # Per-guild correct and incorrect reactions the bot can use, resolved once and ready to be sent
+user_name_cache = OrderedDict() # User IDs with their names and the time the names expire, least recently used first
+chart_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="charts") # Renders charts off the event loop, one at a time as matplotlib isn't thread-safe
+banrate_chart_cache = OrderedDict() # Rendered banrate charts as PNG bytes, keyed on the inputs of the chart
+banrate_logo = None # Logo drawn in the corner of charts, loaded once by the chart thread
+cold_start_seconds = None # Seconds from the start of the process until the bot was ready for the first time
+api_session = None # Pooled HTTP session for the bot website APIs, opened in setup_hook and closed when the bot closes
+guild_count_push_event = asyncio.Event() # Wakes up the guild count push task when the guild count changed
+shard_summaries = {} # Summaries of the other processes of a sharded deployment, keyed on their summary file
 bot_version = "1.0.3"
 chadcounting_color = 0xCA93FF # Color of the embeds
 image_gigachad = "https://github.com/Gitfoe/ChadCounting/blob/main/gigachad.jpeg?raw=true"
@@ -60,9 +166,29 @@ api_discords = "https://discords.com/bots/api/bot/1066081427935993886"
 api_discordbotsgg = "https://discord.bots.gg/api/v1/bots/1066081427935993886"
 
 # Initialize bot and intents
+class ChadCountingBot(commands.AutoShardedBot):
+    """Bot that starts the background tasks of ChadCounting and flushes unsaved changes when it closes.
+    Runs the shards in shard_ids, or all shards Discord recommends if no shards are configured."""
+    async def setup_hook(self):
+        global api_session
+        api_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=api_timeout))
+        self.loop.create_task(write_behind_loop())
+        self.loop.create_task(catch_up_reaction_loop())
+        self.loop.create_task(guild_count_push_loop())
+    async def close(self):
+        if compaction_task != None and not compaction_task.done():
+            await compaction_task # Finish the running compaction, so no journal records get lost
+        persistence_paused_guilds.clear() # Also persist guilds that are in the middle of a catch-up replay
+        await asyncio.wrap_future(flush_guild_changes()) # Guarantee that no changes get lost on shutdown
+        print_persistence_metrics()
+        print_message_filter_stats()
+        await super().close()
+        if api_session != None:
+            await api_session.close()
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+bot = ChadCountingBot(command_prefix='/', intents=intents, shard_ids=shard_ids, shard_count=shard_count)
 #endregion
 
 #region Bot events
@@ -73,37 +199,48 @@ async def on_ready():
     await setup_grouped_commands(bot)
     try:
         await bot.tree.sync() # Sync commands to Discord
-        push_commands_to_discordbotlist() # Sync commands to Discordbotlist
-        push_guilds_count_to_all_bot_websites() # Sync guilds count to bot lists
+        bot.loop.create_task(push_commands_to_discordbotlist()) # Sync commands to Discordbotlist, retries don't delay the start-up
+        guild_count_push_event.set() # Sync guilds count to bot lists
     except Exception as e:
         print(e)
     # Initialise database
-    init_guild_data()
+    await init_guild_data()
     # Check for missed counts on first start-up
-    for guild in bot.guilds:
-        if not dev_active_single_guild or (dev_active_single_guild and guild.id == dev_mode_guild_id):
-            await check_for_missed_counts(guild.id)
-    print(f"[{datetime.now()}] ChadCounting is ready.")
+    await catch_up_on_missed_counts(bot.guilds)
+    global cold_start_seconds
+    if cold_start_seconds == None:
+        cold_start_seconds = time.perf_counter() - process_start_time
+        print(f"[{datetime.now()}] ChadCounting is ready, {cold_start_seconds:.2f} seconds after the process started.")
+        if shard_ids != None:
+            bot.loop.create_task(shard_summary_loop())
+        if preload_deferred_dependencies:
+            asyncio.get_running_loop().run_in_executor(chart_executor, import_deferred_dependencies)
+    else:
+        print(f"[{datetime.now()}] ChadCounting is ready.")
 
 @bot.event
-async def on_resumed():
-    """Discord event that gets triggered once a bot gets resumed from a paused session."""
-    for guild in bot.guilds:
-        if not dev_active_single_guild or (dev_active_single_guild and guild.id == dev_mode_guild_id):
-            await check_for_missed_counts(guild.id)
-    print(f"[{datetime.now()}] ChadCounting has resumed.")
+async def on_shard_resumed(shard_id):
+    """Discord event that gets triggered once a shard gets resumed from a paused session.
+    Only the guilds of that shard can have missed counts, the other shards stayed connected."""
+    await catch_up_on_missed_counts([guild for guild in bot.guilds if guild.shard_id == shard_id])
+    print_message_filter_stats()
+    print(f"[{datetime.now()}] Shard {shard_id} of ChadCounting has resumed.")
 
 @bot.event
 async def on_message(message):
     """Discord event that gets triggered once a message is sent."""
     if bot.is_ready() is not True:
         return
+    if message.channel.id not in counting_channels: # Fast path for the messages outside of counting channels
+        message_filter_stats["filtered"] += 1
+        return
+    message_filter_stats["processed"] += 1
     await check_count_message(message)
 
 @bot.event
 async def on_message_delete(message):
     """Checks if a deleted message is the current count and notify the users of that."""
-    if bot.is_ready() is not True:
+    if bot.is_ready() is not True or message.channel.id not in counting_channels:
         return
     # Ignores messages sent by bots, and if dev_mode is on, exit if message is not from dev mode guild
     if message.author.bot or dev_active_single_guild and not guild_id == dev_mode_guild_id:
@@ -112,23 +249,23 @@ async def on_message_delete(message):
     guild_id = message.guild.id
     user_id = message.author.id
     # If a deleted message is not by someone who counted before, there's no need to continue
-    if user_id not in guild_data[guild_id]:
+    if not penalize_deleted_counts or user_id not in guild_data[guild_id].users:
         return
-    current_count = guild_data[guild_id]["current_count"]
-    last_count = guild_data[guild_id]["previous_message"]
+    current_count = guild_data[guild_id].current_count
+    last_count = guild_data[guild_id].previous_message
     current_user_minutes_ban = check_user_banned(user_id, guild_id)
     if message.created_at == last_count and current_user_minutes_ban <= 0: # Only ban the user if they are not already banned
         # Ban logic
-        banning_enabled = guild_data[guild_id]["s_banning"]
+        banning_enabled = guild_data[guild_id].s_banning
         if banning_enabled:
-            maximum_ban = guild_data[guild_id]["s_maximum_ban"]
-            troll_amplifier = guild_data[guild_id]["s_troll_amplifier"]
+            maximum_ban = guild_data[guild_id].s_maximum_ban
+            troll_amplifier = guild_data[guild_id].s_troll_amplifier
             ban_time_for_troll = maximum_ban * troll_amplifier # Ban the deleter of the message for the troll amount
             success_user_banned = ban_user(user_id, guild_id, ban_time_for_troll)
-            write_guild_data(guild_data)
         else:
             success_user_banned = None
-        guild_data[guild_id]["previous_user"] = None # Reset previous user to no one so anyone can count again
+        guild_data[guild_id].previous_user = None # Reset previous user to no one so anyone can count again
+        mark_guild_dirty(guild_id)
         # Message logic
         embed = chadcounting_embed(f"{message.author.name} deleted a count...")
         full_text = (f"It seems that {message.author.mention} deleted their last counting message!" + 
@@ -139,7 +276,7 @@ async def on_message_delete(message):
             full_text += " However, as they have never counted with ChadCounting before, they won't get banned. Very lucky..."
         embed.add_field(name="", value=full_text, inline=False)
         embed.add_field(name="", value=f"The current count is **{current_count}**. Continue counting from there!", inline=False)
-        counting_channel = bot.get_channel(guild_data[guild_id]["counting_channel"])
+        counting_channel = bot.get_channel(guild_data[guild_id].counting_channel)
         await counting_channel.send(embed=embed)
 
 @bot.event
@@ -148,35 +285,167 @@ async def on_guild_join(guild):
     if bot.is_ready() is not True:
         return
     add_guild_to_guild_data(guild.id)
-    push_guilds_count_to_all_bot_websites() # Sync guilds count with bot lists
+    update_counting_channel(guild.id)
+    update_global_leaderboard(guild.id)
+    resolved_reactions.clear() # The custom emoji of the guild can be used now
+    guild_count_push_event.set() # Sync guilds count with bot lists
+
+@bot.event
+async def on_guild_remove(guild):
+    """When a guild removes the bot, its counting channel no longer gets checked. The guild_data is kept."""
+    update_counting_channel(guild.id, False)
+    global_leaderboard.remove(guild.id)
+    resolved_reactions.clear() # The custom emoji of the guild can't be used anymore
+
+@bot.event
+async def on_guild_emojis_update(guild, before, after):
+    """The bot can use custom emoji of every guild it is in, so the reactions of all guilds are resolved again when needed."""
+    resolved_reactions.clear()
 #endregion                                               
 
 #region Counting logic
-async def check_for_missed_counts(guild_id):
-    """Checks for up to 100 messages of counts that have not been counted because the bot was not running."""
-    last_message = guild_data[guild_id]["previous_message"]
-    if last_message == None:
+def update_counting_channel(guild_id, active=True):
+    """Updates the counting channel of a guild in counting_channels, or removes it if the guild isn't active anymore."""
+    for channel_id in [channel_id for channel_id, channel_guild_id in counting_channels.items() if channel_guild_id == guild_id]:
+        del counting_channels[channel_id]
+    if dev_active_single_guild and guild_id != dev_mode_guild_id:
         return
-    counting_channel = bot.get_channel(guild_data[guild_id]["counting_channel"])
+    if active and guild_id in guild_data and guild_data[guild_id].counting_channel != None:
+        counting_channels[guild_data[guild_id].counting_channel] = guild_id
+
+def print_message_filter_stats():
+    """Prints how many messages were filtered out by the fast path and how many were checked as counts."""
+    filtered = message_filter_stats["filtered"]
+    processed = message_filter_stats["processed"]
+    total = filtered + processed
+    percent_filtered = round(filtered / total * 100, 2) if total > 0 else 0
+    print(f"[{datetime.now()}] Filtered out {filtered} message(s) ({percent_filtered}%) and checked {processed} message(s) in counting channels.")
+
+async def catch_up_on_missed_counts(guilds):
+    """Checks multiple guilds for missed counts concurrently, starting with the guilds that counted most recently.
+    At most catch_up_concurrency guilds catch up at the same time, so the REST calls stay within Discord's
+    rate limits. Requests that do hit a per-route rate limit are delayed by discord.py until the bucket resets."""
+    guild_ids = [guild.id for guild in guilds if guild.id in guild_data and
+                 (not dev_active_single_guild or (dev_active_single_guild and guild.id == dev_mode_guild_id))]
+    guild_ids.sort(key=lambda guild_id: datetime_to_timestamp(guild_data[guild_id].previous_message), reverse=True)
+    semaphore = asyncio.Semaphore(catch_up_concurrency) # Waiting guilds acquire it in order, so the priority is kept
+    start = time.perf_counter()
+    finished = 0
+    async def catch_up(guild_id):
+        nonlocal finished
+        async with semaphore:
+            try:
+                await check_for_missed_counts(guild_id)
+            except Exception:
+                traceback.print_exc()
+        finished += 1
+        if finished % catch_up_progress_interval == 0 and finished < len(guild_ids):
+            print(f"[{datetime.now()}] Caught up on {finished} of {len(guild_ids)} guild(s) in {time.perf_counter() - start:.1f} seconds.")
+    await asyncio.gather(*(catch_up(guild_id) for guild_id in guild_ids))
+    print(f"[{datetime.now()}] Caught up on all {len(guild_ids)} guild(s) in {time.perf_counter() - start:.1f} seconds.")
+
+class CountAcknowledgements:
+    """Collects the replies and reactions to counting messages, so they can be sent after the state of the guild
+    has been updated and its lock has been released."""
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.acknowledgements = [] # Replies (message, embed) and reactions (message, reaction_emoji, current_count) in message order
+    def add_reply(self, message, embed):
+        self.acknowledgements.append((message, embed))
+    def add_reactions(self, message, reaction_emoji, current_count=None):
+        self.acknowledgements.append((message, reaction_emoji, current_count))
+    async def send(self):
+        """Sends all collected replies and reactions at the same time, so a reply doesn't wait for the reactions
+        to the same message or the other way around. The reactions to one message are still added in order."""
+        await asyncio.gather(*(self.send_acknowledgement(acknowledgement) for acknowledgement in self.acknowledgements))
+    async def send_acknowledgement(self, acknowledgement):
+        if len(acknowledgement) == 2:
+            message, embed = acknowledgement
+            await message.reply(embed=embed)
+        else:
+            await add_reactions(*acknowledgement)
+    async def send_catch_up(self):
+        """Sends all collected replies of a catch-up replay. The reactions are handed to the background reaction queue,
+        so they don't hold up the catch-up, and reactions to messages older than catch_up_reaction_max_age are skipped."""
+        skipped = 0
+        for acknowledgement in self.acknowledgements:
+            if len(acknowledgement) == 2:
+                message, embed = acknowledgement
+                try:
+                    await message.reply(embed=embed)
+                except discord.HTTPException as e: # The message could've been deleted in the meantime
+                    print(f"[{datetime.now()}] {self.send_catch_up.__qualname__}: Couldn't reply to a missed count in guild {self.guild_id}: {e}")
+            else:
+                message = acknowledgement[0]
+                message_age = (datetime.now(timezone.utc) - message.created_at).total_seconds()
+                if catch_up_reaction_max_age != None and message_age > catch_up_reaction_max_age:
+                    skipped += 1
+                else:
+                    catch_up_reaction_queue.put_nowait(acknowledgement)
+        if skipped > 0:
+            print(f"[{datetime.now()}] {self.send_catch_up.__qualname__}: Skipped reacting to {skipped} old missed count(s) in guild {self.guild_id}.")
+
+async def catch_up_reaction_loop():
+    """Background task that adds the reactions to missed counts, one message every catch_up_reaction_interval seconds,
+    so catching up on a large backlog doesn't exhaust the reaction rate limit that live counts need as well."""
+    while True:
+        acknowledgement = await catch_up_reaction_queue.get()
+        try:
+            await add_reactions(*acknowledgement)
+        except discord.HTTPException as e: # The message could've been deleted in the meantime
+            print(f"[{datetime.now()}] {catch_up_reaction_loop.__name__}: Couldn't react to a missed count: {e}")
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(catch_up_reaction_interval)
+
+def get_guild_lock(guild_id):
+    """Returns the lock that serializes the counts of a guild. Counts of different guilds don't wait on each other."""
+    lock = guild_locks.get(guild_id)
+    if lock == None:
+        lock = guild_locks[guild_id] = asyncio.Lock()
+    return lock
+
+async def check_for_missed_counts(guild_id):
+    """Replays all messages that have not been counted because the bot was not running, paging through the
+    channel history until the present. All counts are validated in memory first: the changes are persisted,
+    and the replies and reactions are sent, as one batch once the replay is complete.
+    The lock of the guild is held during the replay, so live counts are checked after the missed counts."""
     message_count = 0
     correct_count_amount = 0
     incorrect_count = False
-    if counting_channel != None:
-        permissions = counting_channel.permissions_for(counting_channel.guild.me)
-        if permissions.read_message_history:
-            async for message in counting_channel.history(limit=100, after=last_message):
-                message_count += 1 # Count a message
-                correct_count = await check_count_message(message)
-                if correct_count == True:
-                    correct_count_amount += 1 # Count a correct count
-                elif correct_count == False:
-                    incorrect_count = True
-                    break # Stop checking messages after an incorrect count was logged
-        else:
-            print(f"[{datetime.now()}] {check_for_missed_counts.__name__}: No message history permissions for guild {counting_channel.guild} (ID: {guild_id}) and channel {counting_channel} (ID: {guild_data[guild_id]['counting_channel']}).")
+    acknowledgements = CountAcknowledgements(guild_id)
+    async with get_guild_lock(guild_id):
+        last_message = guild_data[guild_id].previous_message
+        if last_message == None:
+            return
+        counting_channel = bot.get_channel(guild_data[guild_id].counting_channel)
+        if counting_channel != None:
+            permissions = counting_channel.permissions_for(counting_channel.guild.me)
+            if permissions.read_message_history:
+                try:
+                    async for message in counting_channel.history(limit=None, after=last_message, oldest_first=True):
+                        if message_count == 0: # Hold off persisting until the replay is complete, only copied once there are missed messages
+                            persistence_paused_guilds[guild_id] = guild_data[guild_id].to_dict()
+                        message_count += 1 # Count a message
+                        correct_count = await check_count_message(message, acknowledgements)
+                        if correct_count == True:
+                            correct_count_amount += 1 # Count a correct count
+                        elif correct_count == False:
+                            incorrect_count = True
+                            break # Stop checking messages after an incorrect count was logged
+                finally:
+                    if persistence_paused_guilds.pop(guild_id, None) != None:
+                        mark_guild_dirty(guild_id) # Persist the result of the replay as one batch
+            else:
+                print(f"[{datetime.now()}] {check_for_missed_counts.__name__}: No message history permissions for guild {counting_channel.guild} (ID: {guild_id}) and channel {counting_channel} (ID: {guild_data[guild_id].counting_channel}).")
+        current_count = guild_data[guild_id].current_count
+        if incorrect_count == True:
+            # Set previous_message to now, so if the bot goes offline after going online immediately, it knows where to start looking
+            guild_data[guild_id].previous_message = datetime.now()
+            mark_guild_dirty(guild_id)
+    await acknowledgements.send_catch_up()
     if correct_count_amount > 0 or incorrect_count == True:
         embed = chadcounting_embed("ChadCounting is back on track!")
-        current_count = guild_data[guild_id]["current_count"]
         message = ("ChadCounting was offline for a bit and missed some of your counts. " +
                   f"In total, we caught up to {message_count_to_string(message_count)}, " +
                   f"and {message_count_to_string(correct_count_amount, True)}")
@@ -184,84 +453,98 @@ async def check_for_missed_counts(guild_id):
             message += (" However, there was an incorrect count... After an incorrect count, you must start over. " +
                         f"Any counts you lads might have made after the incorrect count were not counted.")
             continue_message = "Please start counting again from **1!**"
-            # Set previous_message to now, so if the bot goes offline after going online immediately, it knows where to start looking
-            guild_data[guild_id]["previous_message"] = datetime.now()
-            write_guild_data(guild_data)
-        elif message_count >= 100: # If the message history limit was reached
-            message += f" Unfortunately, {message_count} is the maximum number of messages we can check. Any counts after count {current_count} have not been counted."
-            continue_message = f"The current count is **{current_count}**. Please continue counting from there! Anyone can continue counting."
-            guild_data[guild_id]["previous_message"] = datetime.now() # If bot goes offline again
-            guild_data[guild_id]["previous_user"] = None # In this case, reset previous user, so anyone can continue counting
-            write_guild_data(guild_data)
         else:
             continue_message = f"The current count is **{current_count}**, so continue counting from there!"
         embed.add_field(name="", value=message, inline=False)
         embed.add_field(name="", value=continue_message, inline=False)
         await counting_channel.send(embed=embed)
 
-async def check_count_message(message):
+async def check_count_message(message, acknowledgements=None):
     """Checks if the user has counted correctly and reacts with an emoji if so. Also checks for incorrect counts."""
-    """Returns True if the message was a correct count and False if it was incorrect. Returns nothing if count wasn't checked."""
-    global guild_data
+    """Returns True if the message was a correct count and False if it was incorrect. Returns nothing if count wasn't checked.
+    The state of the guild is updated while holding its lock, and the replies and reactions are sent after releasing it.
+    During a catch-up replay, which already holds the lock, they are collected in the given acknowledgements instead."""
     # Ignores messages sent by bots, and if dev_mode is on, exit if message is not from dev mode guild
     if message.author.bot or dev_active_single_guild and not message.guild.id == dev_mode_guild_id:
         return
+    if acknowledgements != None:
+        return evaluate_count_message(message, acknowledgements)
+    acknowledgements = CountAcknowledgements(message.guild.id)
+    async with get_guild_lock(message.guild.id):
+        correct_count = evaluate_count_message(message, acknowledgements)
+    await acknowledgements.send()
+    return correct_count
+
+def evaluate_count_message(message, acknowledgements):
+    """Applies a counting message to the state of the guild and collects the replies and reactions it needs.
+    Doesn't await anything, so the state transition is atomic. Returns the same as check_count_message."""
+    guild_id = message.guild.id
+    guild = guild_data[guild_id]
     # Checks if the message is sent in counting channel and starts with a number
-    elif message.channel.id == guild_data[message.guild.id]["counting_channel"] and len(message.content) > 0 and message.content[0].isnumeric():
-        # Declare variables for later use
-        guild_id = message.guild.id
+    if message.channel.id == guild.counting_channel and len(message.content) > 0 and message.content[0].isnumeric():
+        if message.id <= last_checked_message_ids.get(guild_id, 0): # Already checked by the catch-up replay
+            return
+        last_checked_message_ids[guild_id] = message.id
         current_user = message.author.id
-        current_count = guild_data[guild_id]["current_count"]
-        previous_user = guild_data[guild_id]["previous_user"]
-        highest_count = guild_data[guild_id]["highest_count"]
+        current_count = guild.current_count
+        previous_user = guild.previous_user
+        highest_count = guild.highest_count
         add_user_in_guild_data_json(current_user, guild_id) # Try to add new users to the guild
         # Ban logic
-        banning = guild_data[guild_id]["s_banning"]
+        banning = guild.s_banning
         current_user_minutes_ban = check_user_banned(current_user, guild_id)
         if banning and current_user_minutes_ban >= 1:
-            guild_data[guild_id]["previous_message"] = message.created_at # Set to prevent catch up code from counting an ignored/banned count
+            guild.previous_message = message.created_at # Set to prevent catch up code from counting an ignored/banned count
             current_user_ban_string = minutes_to_fancy_string(current_user_minutes_ban)
             embed = chadcounting_embed("You can't count now!")
             embed.add_field(name="", value=f"{message.author.mention}, you are still banned from counting for {current_user_ban_string}, you beta. ", inline=False)
             embed.add_field(name="", value=f"The current count stays on **{current_count}**. Other users can continue counting.", inline=False)
-            await message.reply(embed=embed)
-            write_guild_data(guild_data) # Write count data
+            acknowledgements.add_reply(message, embed)
+            mark_guild_dirty(guild_id) # Write count data
         # End of ban logic
         else:
             if current_user != previous_user:
                 if extract_number_from_string(message.content) == current_count + 1:
                     # Save new counting data
-                    guild_data[guild_id]["current_count"] += 1 # Current count increases by one
-                    guild_data[guild_id]["users"][current_user]["correct_counts"] += 1 # Correct count for user logged
-                    guild_data[guild_id]["previous_user"] = current_user # Previous user is now the user who counted
-                    guild_data[guild_id]["previous_message"] = message.created_at # Save datetime the message was sent
-                    if highest_count < guild_data[guild_id]["current_count"]: # New high score  
-                        guild_data[guild_id]["highest_count"] = guild_data[guild_id]["current_count"]
-                    write_guild_data(guild_data) # Write count data
+                    guild.current_count += 1 # Current count increases by one
+                    guild.users[current_user].correct_counts += 1 # Correct count for user logged
+                    guild.total_correct_counts += 1
+                    guild.previous_user = current_user # Previous user is now the user who counted
+                    guild.previous_message = message.created_at # Save datetime the message was sent
+                    if highest_count < guild.current_count: # New high score  
+                        guild.highest_count = guild.current_count
+                    mark_guild_dirty(guild_id, current_user) # Write count data
+                    update_global_leaderboard(guild_id)
+                    update_user_ranking(guild_id, current_user)
+                    update_global_user(guild_id, current_user, correct_counts=1)
                     # Acknowledge a correct count
-                    correct_reactions = guild_data[guild_id]["s_correct_reaction"]
-                    correct_reactions = remove_unavailable_emoji(correct_reactions, "🙂")
-                    await add_reactions(message, correct_reactions, current_count)
+                    correct_reactions = get_resolved_reactions(guild_id)[0]
+                    acknowledgements.add_reactions(message, correct_reactions, current_count)
                     return True
                 else:
-                    await handle_incorrect_count(message, current_count, highest_count) # Wrong count
+                    handle_incorrect_count(message, current_count, highest_count, acknowledgements) # Wrong count
                     return False
             else:
-                pass_doublecount = guild_data[guild_id]["s_pass_doublecount"]
-                await handle_incorrect_count(message, current_count, highest_count, pass_doublecount) # Repeated count
+                pass_doublecount = guild.s_pass_doublecount
+                handle_incorrect_count(message, current_count, highest_count, acknowledgements, pass_doublecount) # Repeated count
                 return False
 
-async def handle_incorrect_count(message, current_count, highest_count, pass_doublecount=None):
-    """Sends the correct error message to the user for counting incorrectly.
+def handle_incorrect_count(message, current_count, highest_count, acknowledgements, pass_doublecount=None):
+    """Resets the count and collects the correct error message for the user for counting incorrectly.
     No value for 'pass_doublecount' entered means that it is not a double count."""
     if pass_doublecount == None or pass_doublecount == False: # Only check incorrect counting if passing double counting allowed
-        global guild_data
         guild_id = message.guild.id
-        guild_data[guild_id]["previous_counts"].append(current_count) # Save the count
-        guild_data[guild_id]["current_count"] = 0 # Reset count to 0
-        guild_data[guild_id]["previous_user"] = None # Reset previous user to no one so anyone can count again
-        guild_data[guild_id]["previous_message"] = None # Reset timer of previous message for the bot catch up code
-        guild_data[guild_id]["users"][message.author.id]["incorrect_counts"] += 1 # Save incorrect count for the user
+        guild = guild_data[guild_id]
+        guild.add_previous_count(current_count) # Save the count
+        archive_previous_counts(guild_id)
+        guild.current_count = 0 # Reset count to 0
+        guild.previous_user = None # Reset previous user to no one so anyone can count again
+        guild.previous_message = None # Reset timer of previous message for the bot catch up code
+        guild.users[message.author.id].incorrect_counts += 1 # Save incorrect count for the user
+        guild.total_incorrect_counts += 1
+        update_global_leaderboard(guild_id)
+        update_user_ranking(guild_id, message.author.id)
+        update_global_user(guild_id, message.author.id, incorrect_counts=1)
         full_text = f"What a beta move by {message.author.mention}. "
         suffix_text = f"Only gigachads should be in charge of counting. Please start again from 1. The high score is {highest_count}."
         if pass_doublecount == None: # Not a double count
@@ -269,247 +552,884 @@ async def handle_incorrect_count(message, current_count, highest_count, pass_dou
         else: # Is a double count
             full_text += f"A user cannot count twice in a row. {suffix_text}"
         # User ban logic
-        banning_enabled = guild_data[guild_id]["s_banning"]
+        banning_enabled = guild.s_banning
         if banning_enabled:
             average_count = calculate_average_count_of_guild(guild_id)
             message_count = message.content # What the value was the user sent in the message
-            minimum_ban = guild_data[guild_id]["s_minimum_ban"]
-            maximum_ban = guild_data[guild_id]["s_maximum_ban"]
-            ban_range = guild_data[guild_id]["s_ban_range"]
-            troll_amplifier = guild_data[guild_id]["s_troll_amplifier"]
-            current_user_minutes_ban = round(calculate_user_penalization(
-                current_count, average_count, minimum_ban, maximum_ban, ban_range, troll_amplifier, message_count
-                ))
+            maximum_ban = guild.s_maximum_ban
+            current_user_minutes_ban = round(calculate_user_penalization(guild_id, current_count, average_count, message_count))
             if current_user_minutes_ban > 0:
                 ban_user(message.author.id, guild_id, current_user_minutes_ban)
                 current_user_ban_string = minutes_to_fancy_string(current_user_minutes_ban)
                 full_text += f" Moreover, because you messed up, you are now banned for {current_user_ban_string}."
                 if current_user_minutes_ban > maximum_ban:
                     full_text += f" ⚠️ **Don't be a troll, {message.author.name}.**"
-        write_guild_data(guild_data) # Write count data
+        mark_guild_dirty(guild_id, message.author.id) # Write count data
         # Embed incorrect number message
         embed = chadcounting_embed("Whoops...!")
         embed.add_field(name="", value=full_text)
-        await message.reply(embed=embed)
+        acknowledgements.add_reply(message, embed)
         # Acknowledge an incorrect count
-        incorrect_reactions = guild_data[guild_id]["s_incorrect_reaction"]
-        incorrect_reactions = remove_unavailable_emoji(incorrect_reactions, "💀")
-        await add_reactions(message, incorrect_reactions)
+        incorrect_reactions = get_resolved_reactions(guild_id)[1]
+        acknowledgements.add_reactions(message, incorrect_reactions)
     else: # Pass/do nothing if passing of double counting is allowed
         pass
 
 async def add_reactions(message, reaction_emoji, current_count=None):
-    """Adds one or more emoji as reactions to a message."""
+    """Adds one or more emoji as reactions to a message. If the guild counts faster than reactions can be added,
+    and single_reaction_under_load is enabled, only the first emoji is added, so the reactions don't fall behind."""
     if message.channel.permissions_for(message.guild.me).add_reactions: # Only react if you have permission
-        for emoji in reaction_emoji:
-            await message.add_reaction(emoji)
-        if current_count is not None and str(current_count + 1).find("69") != -1: # React with a funny emoji if ( ͡° ͜ʖ ͡°) is in the number
-            await message.add_reaction("💦")
+        guild_id = message.guild.id
+        under_load = single_reaction_under_load and pending_reactions.get(guild_id, 0) >= reaction_backlog_threshold
+        if under_load:
+            reaction_emoji = reaction_emoji[:1]
+        pending_reactions[guild_id] = pending_reactions.get(guild_id, 0) + 1
+        try:
+            for emoji in reaction_emoji:
+                await message.add_reaction(emoji)
+            if not under_load and current_count is not None and str(current_count + 1).find("69") != -1: # React with a funny emoji if ( ͡° ͜ʖ ͡°) is in the number
+                await message.add_reaction("💦")
+        finally:
+            pending_reactions[guild_id] -= 1
+            if pending_reactions[guild_id] == 0:
+                del pending_reactions[guild_id]
     else:
         print(f"[{datetime.now()}] {add_reactions.__name__}: No add reactions permissions for guild {message.guild.name} (ID: {message.guild.id}).")
 #endregion
 
+#region Guild and user records
+class UserState:
+    """Counting data of a user in a guild. Uses __slots__, so millions of users don't each need a dictionary."""
+    __slots__ = ("time_banned", "ban_time", "correct_counts", "incorrect_counts")
+    def __init__(self, time_banned=None, ban_time=0, correct_counts=0, incorrect_counts=0):
+        self.time_banned = time_banned
+        self.ban_time = ban_time
+        self.correct_counts = correct_counts
+        self.incorrect_counts = incorrect_counts
+    @classmethod
+    def from_dict(cls, values):
+        """Creates a user from its guild_data.json dictionary. Missing values get their default value."""
+        return cls(**{k: v for k, v in values.items() if k in cls.__slots__})
+    def to_dict(self):
+        """Converts the user to its guild_data.json dictionary."""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+class GuildState:
+    """Counting data and settings of a guild. Uses __slots__ like UserState."""
+    __slots__ = ("current_count", "highest_count", "previous_user", "previous_message", "counting_channel", "users",
+                 "previous_counts", "previous_counts_cold_amount", "previous_counts_sum", "previous_counts_amount", "previous_counts_ewma",
+                 "s_correct_reaction", "s_incorrect_reaction", "s_pass_doublecount", "s_banning",
+                 "s_minimum_ban", "s_maximum_ban", "s_ban_range", "s_troll_amplifier",
+                 "total_correct_counts", "total_incorrect_counts")
+    derived_slots = ("total_correct_counts", "total_incorrect_counts") # Calculated from the users, not stored in guild_data.json
+    def __init__(self):
+        self.current_count = 0
+        self.highest_count = 0
+        self.previous_user = None
+        self.previous_message = None
+        self.counting_channel = None
+        self.users = {}
+        self.previous_counts = array("I") # Most recent counts a streak ended on, older counts are in the cold history file
+        self.previous_counts_cold_amount = 0 # Amount of previous counts in the cold history file
+        self.previous_counts_sum = 0 # Running aggregates of previous_counts, so averages don't need the whole list
+        self.previous_counts_amount = 0
+        self.previous_counts_ewma = 0.0
+        self.s_correct_reaction = ["🙂"]
+        self.s_incorrect_reaction = ["💀"]
+        self.s_pass_doublecount = False
+        self.s_banning = True
+        self.s_minimum_ban = 1
+        self.s_maximum_ban = 120
+        self.s_ban_range = 1.1
+        self.s_troll_amplifier = 7
+        self.total_correct_counts = 0 # Sums of the counts of all users
+        self.total_incorrect_counts = 0
+    @classmethod
+    def from_dict(cls, values):
+        """Creates a guild and its users from its guild_data.json dictionary. Missing values get their default value."""
+        guild = cls()
+        for k, v in values.items():
+            if k == "users":
+                guild.users = {user_id: UserState.from_dict(user) for user_id, user in v.items()}
+            elif k == "previous_counts":
+                guild.previous_counts = decode_previous_counts(v) if isinstance(v, str) else array("I", v)
+            elif k in cls.__slots__:
+                setattr(guild, k, v)
+        if guild.previous_counts_amount < len(guild.previous_counts): # Stored before the aggregates were added
+            guild.calculate_previous_count_aggregates()
+        guild.total_correct_counts = sum(user.correct_counts for user in guild.users.values())
+        guild.total_incorrect_counts = sum(user.incorrect_counts for user in guild.users.values())
+        return guild
+    def add_previous_count(self, count):
+        """Saves the count a streak ended on and updates the running aggregates in constant time."""
+        self.previous_counts.append(count)
+        self.previous_counts_sum += count
+        self.previous_counts_amount += 1
+        if self.previous_counts_amount == 1:
+            self.previous_counts_ewma = float(count)
+        else:
+            self.previous_counts_ewma += average_count_ewma_alpha * (count - self.previous_counts_ewma)
+    def calculate_previous_count_aggregates(self):
+        """Calculates the running aggregates from the full previous_counts list."""
+        counts = self.previous_counts
+        self.previous_counts = array("I")
+        self.previous_counts_sum = 0
+        self.previous_counts_amount = 0
+        for count in counts:
+            self.add_previous_count(count)
+    def to_dict(self, include_users=True):
+        """Converts the guild to its guild_data.json dictionary. Lists and arrays are copied, so the dictionary
+        can safely be serialized on another thread. Without users, it's the guild record of the journal."""
+        values = {}
+        for k in self.__slots__:
+            if k in self.derived_slots:
+                continue
+            elif k == "users":
+                if include_users:
+                    values[k] = {user_id: user.to_dict() for user_id, user in self.users.items()}
+            else:
+                v = getattr(self, k)
+                values[k] = v[:] if isinstance(v, (list, array)) else v
+        return values
+#endregion
+
+#region Ranking indexes
+class RankingIndex:
+    """Keeps items sorted on a key from best to worst, so the top of a ranking and the rank of an item can be looked up
+    without sorting all items. Rank lookups are O(log n), and updating an item only moves its entry in the sorted list."""
+    def __init__(self, items=()):
+        """Builds the ranking of (item ID, key) pairs with a single sort, instead of inserting them one by one."""
+        self.entries = {item_id: (tuple(-value for value in key), item_id) for item_id, key in items} # Current entry of every item
+        self.sorted_entries = sorted(self.entries.values()) # Entries (negated key, item ID) in ascending order, so the best item comes first
+    def __len__(self):
+        return len(self.entries)
+    def update(self, item_id, key):
+        """Adds an item with its key, which is a tuple of numbers where higher is better, or moves it to its new rank."""
+        entry = (tuple(-value for value in key), item_id)
+        old_entry = self.entries.get(item_id)
+        if entry == old_entry:
+            return
+        if old_entry != None:
+            del self.sorted_entries[bisect_left(self.sorted_entries, old_entry)]
+        insort(self.sorted_entries, entry)
+        self.entries[item_id] = entry
+    def remove(self, item_id):
+        """Removes an item from the ranking."""
+        old_entry = self.entries.pop(item_id, None)
+        if old_entry != None:
+            del self.sorted_entries[bisect_left(self.sorted_entries, old_entry)]
+    def rank(self, item_id):
+        """Returns the rank of an item, starting at 1, or None if the item isn't in the ranking."""
+        entry = self.entries.get(item_id)
+        if entry == None:
+            return None
+        return bisect_left(self.sorted_entries, entry) + 1
+    def top(self, amount):
+        """Returns the IDs of the best items."""
+        return [item_id for _, item_id in self.sorted_entries[:amount]]
+
+global_leaderboard = RankingIndex() # Guilds the bot is in, ranked on high score, then percent correct, then total counts
+user_rankings = {} # Per-guild ranking of users on total counts, then correct counts, built at load
+
+def update_global_leaderboard(guild_id):
+    """Updates the rank of a guild in the global leaderboard after its counts changed."""
+    guild = guild_data[guild_id]
+    total_counts = guild.total_correct_counts + guild.total_incorrect_counts
+    percent_correct = round((guild.total_correct_counts / total_counts) * 100, 2) if total_counts > 0 else 0
+    global_leaderboard.update(guild_id, (guild.highest_count, percent_correct, total_counts))
+
+def summarize_leaderboard_guild(guild_id):
+    """Returns what the global leaderboard shows of a guild of this process, in the format of the shard summaries."""
+    discord_guild = bot.get_guild(guild_id)
+    return {"guild_id": guild_id, "name": discord_guild.name if discord_guild != None else str(guild_id),
+            "key": [-value for value in global_leaderboard.entries[guild_id][0]], "current_count": guild_data[guild_id].current_count}
+
+def get_merged_leaderboard_top(amount):
+    """Returns the summaries of the best guilds of all shards, merged from the leaderboard of this process
+    and the best guilds in the summaries of the other processes of a sharded deployment."""
+    entries = [summarize_leaderboard_guild(guild_id) for guild_id in global_leaderboard.top(amount)]
+    for summary in shard_summaries.values():
+        entries.extend(summary["top"])
+    entries.sort(key=lambda entry: entry["key"], reverse=True)
+    return entries[:amount]
+
+def get_merged_leaderboard_rank(guild_id):
+    """Returns the rank of a guild of this process over all shards, or None if it isn't ranked, and the amount of ranked guilds.
+    The summaries of the other processes hold the sorted keys of all their guilds, so the better guilds are counted with a bisection."""
+    rank = global_leaderboard.rank(guild_id)
+    amount = len(global_leaderboard)
+    for summary in shard_summaries.values():
+        amount += len(summary["keys"])
+        if rank != None:
+            rank += bisect_left(summary["keys"], list(global_leaderboard.entries[guild_id][0]))
+    return rank, amount
+
+def get_user_ranking(guild_id):
+    """Returns the ranking of the users of a guild, and builds it if it wasn't built at load."""
+    ranking = user_rankings.get(guild_id)
+    if ranking == None:
+        users = guild_data[guild_id].users
+        ranking = user_rankings[guild_id] = RankingIndex((user_id, (user.correct_counts + user.incorrect_counts, user.correct_counts))
+                                                         for user_id, user in users.items())
+    return ranking
+
+def update_user_ranking(guild_id, user_id):
+    """Updates the rank of a user in the ranking of a guild after their counts changed, if the ranking has been built."""
+    ranking = user_rankings.get(guild_id)
+    if ranking != None:
+        user = guild_data[guild_id].users[user_id]
+        ranking.update(user_id, (user.correct_counts + user.incorrect_counts, user.correct_counts))
+
+class GlobalUserState:
+    """The guilds a user counted in and their counts summed over all those guilds."""
+    __slots__ = ("guild_ids", "correct_counts", "incorrect_counts")
+    def __init__(self):
+        self.guild_ids = set()
+        self.correct_counts = 0
+        self.incorrect_counts = 0
+
+global_users = {} # User ID to GlobalUserState, built at load
+global_users_unindexed_guilds = None # Guilds not added to global_users yet while it's built, None before the build starts
+
+def get_global_user(user_id):
+    """Returns the counts of a user over all guilds. Until the cross-guild index of users is built at load,
+    they are summed from guild_data instead."""
+    if global_users_unindexed_guilds == None or len(global_users_unindexed_guilds) > 0:
+        global_user = GlobalUserState()
+        for guild_id, guild in guild_data.items():
+            user = guild.users.get(user_id)
+            if user != None:
+                global_user.guild_ids.add(guild_id)
+                global_user.correct_counts += user.correct_counts
+                global_user.incorrect_counts += user.incorrect_counts
+        return global_user
+    return global_users.get(user_id, GlobalUserState())
+
+def update_global_user(guild_id, user_id, correct_counts=0, incorrect_counts=0):
+    """Adds a guild and new counts of a user to the cross-guild index of users, unless the guild still has to be indexed,
+    in which case its current counts get added once it is."""
+    if global_users_unindexed_guilds != None and guild_id not in global_users_unindexed_guilds:
+        global_user = global_users.setdefault(user_id, GlobalUserState())
+        global_user.guild_ids.add(guild_id)
+        global_user.correct_counts += correct_counts
+        global_user.incorrect_counts += incorrect_counts
+
+async def build_user_indexes():
+    """Builds the ranking of the users of every guild and the cross-guild index of users at load, so no command has to.
+    A guild is indexed at once, other tasks get to run after every index_build_batch_size users."""
+    global global_users_unindexed_guilds
+    global_users_unindexed_guilds = set(guild_data)
+    batch_users = 0
+    for guild_id in list(guild_data):
+        guild = guild_data[guild_id]
+        get_user_ranking(guild_id)
+        for user_id, user in guild.users.items():
+            global_user = global_users.setdefault(user_id, GlobalUserState())
+            global_user.guild_ids.add(guild_id)
+            global_user.correct_counts += user.correct_counts
+            global_user.incorrect_counts += user.incorrect_counts
+        global_users_unindexed_guilds.discard(guild_id)
+        batch_users += len(guild.users)
+        if batch_users >= index_build_batch_size:
+            await asyncio.sleep(0)
+            batch_users = 0
+#endregion
+
 #region JSON DB helper functions
+guild_data_datetime_keys = ("time_banned", "previous_message") # Values that are stored as ISO strings
+
 class DateTimeEncoder(json.JSONEncoder):
     """Extends the JSONEncoder class to serialize unserializable data into strings."""
     def default(self, o):
         if isinstance(o, datetime):
             return o.isoformat()
+        if isinstance(o, array):
+            return encode_previous_counts(o)
         return json.JSONEncoder.default(self, o)
 
-def init_guild_data():
-    """Initializes the guild_data.json file, or loads it into the bot."""
-    global guild_data
+def decode_guild_data_object(pairs):
+    """Hook for json.loads that converts the keys that are guild or user IDs to integers, and the values that
+    are datetimes from ISO strings to datetimes, while the JSON is being parsed."""
+    values = {}
+    for k, v in pairs:
+        if k.isdigit():
+            k = int(k)
+        elif k in guild_data_datetime_keys and isinstance(v, str):
+            v = datetime.fromisoformat(v)
+        values[k] = v
+    return values
+
+def encode_previous_counts(previous_counts):
+    """Compresses an array of previous counts into a string, which is a lot smaller than a JSON list of numbers."""
+    previous_counts = previous_counts[:]
+    if sys.byteorder == "big": # Always store the counts in little-endian
+        previous_counts.byteswap()
+    return "zlib:" + base64.b64encode(zlib.compress(previous_counts.tobytes())).decode()
+
+def decode_previous_counts(text):
+    """Decompresses a string of encode_previous_counts back into an array of previous counts."""
+    previous_counts = array("I", zlib.decompress(base64.b64decode(text.removeprefix("zlib:"))))
+    if sys.byteorder == "big":
+        previous_counts.byteswap()
+    return previous_counts
+
+def archive_previous_counts(guild_id):
+    """Moves the oldest previous counts of a guild to its cold history file once it has twice the amount of the
+    previous_counts_hot_window, so guild_data only keeps the most recent counts and the running aggregates.
+    The counts are only removed from guild_data once the cold history file is written, a failed write is retried on the next archive."""
+    guild = guild_data[guild_id]
+    if len(guild.previous_counts) < 2 * previous_counts_hot_window or guild_id in archiving_guilds:
+        return
+    archived_amount = len(guild.previous_counts) - previous_counts_hot_window
+    archived_counts = guild.previous_counts[:archived_amount]
+    archiving_guilds.add(guild_id)
+    def finish_archive(future):
+        archiving_guilds.discard(guild_id)
+        if future.cancelled() or future.result() != True:
+            return # The counts are still in guild_data
+        del guild.previous_counts[:archived_amount] # New counts are only appended, so the archived counts are still the oldest
+        guild.previous_counts_cold_amount += archived_amount
+        mark_guild_dirty(guild_id)
+    future = submit_persistence_task(append_cold_previous_counts, guild_id, guild.previous_counts_cold_amount, archived_counts)
+    asyncio.wrap_future(future).add_done_callback(finish_archive)
+
+def append_cold_previous_counts(guild_id, cold_amount, previous_counts):
+    """Appends previous counts to the cold history file of a guild and returns True once they are written. Runs on the persistence thread.
+    The file is cut off at cold_amount first, so counts archived before a crash aren't written twice.
+    Raises a ValueError if the file holds less than cold_amount counts, instead of filling the gap with zeros."""
+    os.makedirs(previous_counts_cold_directory, exist_ok=True)
+    if sys.byteorder == "big":
+        previous_counts.byteswap()
+    file = os.path.join(previous_counts_cold_directory, f"{guild_id}.bin")
+    with open(file, "ab") as f:
+        cold_size = cold_amount * previous_counts.itemsize
+        if f.seek(0, os.SEEK_END) < cold_size:
+            raise ValueError(f"{file} holds less than the {cold_amount} archived previous counts of guild {guild_id}.")
+        f.truncate(cold_size)
+        previous_counts.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+async def init_guild_data():
+    """Initializes the guild_data.json file, or loads it into the bot.
+    Loading happens on the persistence thread, so the event loop doesn't block on the filesystem."""
+    global guild_data, guild_data_generation, compaction_task
+    start_time = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    raw_guild_data, guild_data_generation, schema_version, recovered = await loop.run_in_executor(persistence_executor, load_guild_data)
+    await loop.run_in_executor(persistence_executor, migrate_guild_data, raw_guild_data, guild_data_generation, schema_version)
+    guild_data = {guild_id: GuildState.from_dict(values) for guild_id, values in raw_guild_data.items()}
+    for guild_id in guild_data:
+        archive_previous_counts(guild_id) # Guilds stored before the hot window was added can have a long history
+    if recovered: # Keep the journal, the recovered snapshot is written with its generation so the journal still gets replayed on top
+        snapshot = await snapshot_guild_data()
+        await asyncio.wrap_future(submit_persistence_task(write_guild_data, snapshot, False, guild_data_generation))
+    else:
+        compaction_task = loop.create_task(compact_guild_data())
+        await compaction_task # Start with a fresh snapshot and an empty journal
+    for guild in bot.guilds:
+        if not dev_active_single_guild or (dev_active_single_guild and guild.id == dev_mode_guild_id):
+            add_guild_to_guild_data(guild.id)
+    for guild in bot.guilds:
+        update_counting_channel(guild.id)
+        if guild.id in guild_data:
+            update_global_leaderboard(guild.id)
+    await build_user_indexes()
+    load_seconds = time.perf_counter() - start_time
+    print(f"[{datetime.now()}] Successfully loaded {len(guild_data)} guild(s) in {load_seconds:.2f} seconds, {peak_memory_usage_string()}.")
+
+def load_guild_data(file=None, journal_file=None):
+    """Reads guild_data.json and replays the changes in the journal that were not compacted yet on top of it.
+    Falls back to the newest valid backup if guild_data.json is corrupt, on which the journals written since
+    that backup are replayed. Other files than guild_data_file and guild_data_journal_file can be given.
+    The first time a process of a sharded deployment starts, its guilds are loaded from the unsharded files.
+    Returns the loaded guild_data as dictionaries, like they are stored in guild_data.json, its generation, its schema
+    version and whether it was recovered from a backup. Snapshots written before schema versions were added are of schema version 0."""
+    if file == None:
+        file, journal_file = guild_data_file, guild_data_journal_file
+    data = {}
+    header = {}
+    recovered = False
     try:
-        with open("guild_data.json", "r") as f:
+        data, header = read_guild_data_file(file)
+        print(f"[{datetime.now()}] {file} successfully loaded.")
+    except FileNotFoundError:
+        if shard_ids != None and file == guild_data_file:
+            check_no_other_files_of_shards()
+            if os.path.exists(unsharded_guild_data_files[0]):
+                return load_shard_guild_data_from_unsharded_files()
+        print(f"[{datetime.now()}] {file} didn't exist and will be created.")
+    except ValueError as e:
+        print(f"[{datetime.now()}] There was an error reading {file}: {e} Trying to recover from a backup.")
+        data, header = recover_guild_data_from_backup(file)
+        recovered = True
+    generation = int(header.get("generation", 0))
+    schema_version = int(header.get("schema", 0)) if data else guild_data_schema_version # A new database needs no migrations
+    if recovered:
+        generation = replay_guild_data_journals_since_backup(data, generation, journal_file)
+    else:
+        replay_guild_data_journal(data, generation, journal_file)
+    return data, generation, schema_version, recovered
+
+def check_no_other_files_of_shards():
+    """Raises an exception if other files than the ones of this process hold guilds of its shards, which happens when
+    SHARD_IDS changed. Loading the unsharded files or starting empty would then revert or lose the counts of those guilds.
+    Files of other shards are fine, as all processes of a new sharded deployment load the unsharded files at the same time."""
+    prefix = os.path.splitext(unsharded_guild_data_files[0])[0] + ".shard"
+    for file in sorted(glob.glob(f"{glob.escape(prefix)}*")):
+        match = re.match(r"([\d-]+)\.", file[len(prefix):])
+        if match != None and set(int(shard_id) for shard_id in match.group(1).split("-")) & set(shard_ids):
+            raise Exception(f"{guild_data_file} doesn't exist, but {file} holds guilds of the shards of this process. "
+                            f"The shards of this process changed, merge the files of its shards into {guild_data_file} first.")
+
+def load_shard_guild_data_from_unsharded_files():
+    """Loads the guilds of the shards of this process from the unsharded guild_data.json and its journal.
+    Returns the same as load_guild_data, with generation 0 as this process has no journal yet."""
+    data, _, schema_version, _ = load_guild_data(*unsharded_guild_data_files)
+    data = {guild_id: values for guild_id, values in data.items() if guild_shard_id(guild_id) in shard_ids}
+    print(f"[{datetime.now()}] Loaded {len(data)} guild(s) of {shard_name} from {unsharded_guild_data_files[0]}, it's saved to {guild_data_file} from now on.")
+    return data, 0, schema_version, False
+
+def read_guild_data_file(file):
+    """Reads a guild_data snapshot and verifies its checksum. Returns the data and the values of the header.
+    Raises a ValueError if the snapshot is corrupt, for instance because a crash truncated it.
+    The file is read as bytes and keys and datetimes are decoded while parsing, so no extra copies of the data are made."""
+    header = {}
+    with open(file, "rb") as f:
+        header_line = f.readline()
+        if header_line.startswith(snapshot_header_prefix.encode()): # Snapshots written before checksums were added have no header
+            header = parse_header_line(header_line.decode())
             file_content = f.read()
-            if file_content:
-                guild_data = json.loads(file_content)
-                guild_data = convert_keys_to_int(guild_data)
-                # Converts isoformats in guild_data.json to datetime objects
-                for v in guild_data.values():
-                    if "previous_message" in v and v["previous_message"] != None:
-                        v["previous_message"] = datetime.fromisoformat(v["previous_message"])
-                    if "users" in v:
-                        for value in v["users"].values():
-                            if value["time_banned"] != None:
-                                value["time_banned"] = datetime.fromisoformat(value["time_banned"])
-        print(f"[{datetime.now()}] guild_data.json successfully loaded.")
+            if hashlib.sha256(file_content).hexdigest() != header.get("sha256"):
+                raise ValueError(f"The checksum of {file} doesn't match its contents.")
+        else:
+            file_content = header_line + f.read()
+    data = json.loads(file_content, object_pairs_hook=decode_guild_data_object) if file_content else {} # A JSONDecodeError is a ValueError as well
+    return data, header
+
+def recover_guild_data_from_backup(file):
+    """Loads the newest backup of a guild_data snapshot that passes validation. Returns the data and the values of the header.
+    The corrupt snapshot is copied to file.corrupt followed by a timestamp, so it's kept once the recovered snapshot is written.
+    The corrupt snapshot itself stays in place until then, so a start-up that fails before that recovers again."""
+    backups = sorted(glob.glob(f"{glob.escape(file)}.bak*"), key=os.path.getmtime, reverse=True)
+    for backup in backups:
+        try:
+            data, header = read_guild_data_file(backup)
+        except ValueError as e:
+            print(f"[{datetime.now()}] Backup {backup} is not valid either: {e}")
+            continue
+        corrupt_file = f"{file}.corrupt{format_current_datetime(datetime.now(), False, False)}"
+        shutil.copy2(file, corrupt_file)
+        print(f"[{datetime.now()}] Recovered guild_data from backup {backup}, the corrupt snapshot was copied to {corrupt_file}.")
+        return data, header
+    raise Exception(f"There was an error decoding {file} and no valid backup could be found.")
+
+def parse_header_line(header_line):
+    """Converts a header line like '#chadcounting sha256=abc generation=2 schema=1' into a dictionary."""
+    return dict(value.split("=", 1) for value in header_line.split()[1:])
+
+def replay_guild_data_journal(data, generation, journal_file):
+    """Applies the records of guild_data.journal to the loaded data. Returns the amount of replayed records.
+    The journal is skipped if it belongs to another snapshot generation, which happens when the bot stopped
+    after writing a compacted snapshot but before emptying the journal. An incomplete record is ignored."""
+    replayed = 0
+    try:
+        with open(journal_file, "r") as f:
+            for line in f:
+                if line.startswith(snapshot_header_prefix):
+                    journal_generation = int(parse_header_line(line).get("generation", 0))
+                    if journal_generation != generation:
+                        print(f"[{datetime.now()}] {journal_file} is of generation {journal_generation} instead of {generation} and was skipped.")
+                        return replayed
+                    continue
+                try:
+                    record = json.loads(line, object_pairs_hook=decode_guild_data_object)
+                except json.decoder.JSONDecodeError:
+                    print(f"[{datetime.now()}] {replay_guild_data_journal.__name__}: Skipped an incomplete journal record.")
+                    continue
+                guild = data.setdefault(record["guild_id"], {"users": {}})
+                guild.update(record["guild"])
+                if "user_id" in record:
+                    guild["users"][record["user_id"]] = record["user"]
+                replayed += 1
     except FileNotFoundError:
-        write_guild_data(guild_data)
-        print(f"[{datetime.now()}] guild_data.json didn't exist and was created.")
-    except json.decoder.JSONDecodeError:
-        raise Exception("There was an error decoding guild_data.json.")
-    finally:
-        for guild in bot.guilds:
-            if not dev_active_single_guild or (dev_active_single_guild and guild.id == dev_mode_guild_id):
-                add_or_update_new_guild_data(guild.id)
-        if update_guild_data: # If updating is on, also check the existing guilds in guild_data (if the bot left a guild)
-            for guild_id in guild_data:
-                if not dev_active_single_guild or (dev_active_single_guild and guild_id == dev_mode_guild_id):
-                    add_or_update_new_guild_data(guild_id)
-        print(f"[{datetime.now()}] Successfully loaded {len(guild_data)} guild(s).")
-
-def add_or_update_new_guild_data(guild_id):
-    """Adds new guilds and/or users to guild_data and updates them if needed."""
-    add_guild_to_guild_data(guild_id, update_guild_data)
-    if update_guild_data:
-        for user_id in guild_data[guild_id]["users"]:
-            add_user_in_guild_data_json(user_id, guild_id, update_guild_data)
-
-def write_guild_data(guild_data, backup=False):
-    """Writes the dictionary guild_data to guild_data.json.
-    Optional backup parameter forces a backup filename format."""
-    file = "guild_data.json"
-    if backup:
-        timestamp = format_current_datetime(datetime.now(), False, False)
-        file = f"{file}.bak{timestamp}"
+        pass # No journal means there are no changes since the last snapshot
+    if replayed > 0:
+        print(f"[{datetime.now()}] Replayed {replayed} record(s) of {journal_file}.")
+    return replayed
+
+def replay_guild_data_journals_since_backup(data, generation, journal_file):
+    """Applies the records of the journal and its backups of the generation of a recovered backup and newer, oldest first.
+    The journal of a generation holds the changes made after the snapshot of that generation, so replaying them all
+    brings the backup up to date. Returns the generation of the newest replayed journal."""
+    journals = []
+    for file in glob.glob(f"{glob.escape(journal_file)}.bak.[0-9]*") + [journal_file]:
         try:
             with open(file, "r") as f:
-                return # Stop backing up if file already exists
+                header_line = f.readline()
         except FileNotFoundError:
-            pass # Continue if file doesn't exist
-        except Exception as e:
-            print(e)
-    if is_jsonable(guild_data):
-        with open(file, "w") as f:
-            json.dump(guild_data, f, cls=DateTimeEncoder)
-    else:
-        file = "guild_data.json.err"
+            continue
+        if header_line.startswith(snapshot_header_prefix):
+            journal_generation = int(parse_header_line(header_line).get("generation", 0))
+            if journal_generation >= generation:
+                journals.append((journal_generation, file))
+    next_generation = generation
+    for journal_generation, file in sorted(journals):
+        if journal_generation > next_generation:
+            print(f"[{datetime.now()}] No journal of generation {next_generation} to {journal_generation - 1} was found, changes made during those generations are lost.")
+        replay_guild_data_journal(data, journal_generation, file)
+        generation = journal_generation
+        next_generation = journal_generation + 1
+    return generation
+
+def mark_guild_dirty(guild_id, user_id=None):
+    """Marks a guild, and optionally one of its users, as changed. The changes get flushed to the journal
+    in batches by the write-behind task, at most write_behind_latency seconds later."""
+    changed_users = dirty_guilds.setdefault(guild_id, set())
+    if user_id != None:
+        changed_users.add(user_id)
+    dirty_guilds_event.set()
+
+async def snapshot_guild_data():
+    """Returns a copy of the full guild_data that can safely be serialized on another thread.
+    Guilds are copied in batches of snapshot_batch_size users, in between counts keep being handled.
+    A guild is always copied at once, so the copy of every guild is consistent. Guilds in a catch-up replay
+    are stored with their state from before the replay, their changes stay dirty until the replay is complete."""
+    snapshot = {}
+    batch_users = 0
+    start = time.perf_counter()
+    for guild_id in list(guild_data):
+        guild = guild_data[guild_id]
+        paused_guild = persistence_paused_guilds.get(guild_id)
+        snapshot[guild_id] = paused_guild if paused_guild != None else guild.to_dict()
+        batch_users += len(guild.users) + 1
+        if batch_users >= snapshot_batch_size:
+            persistence_metrics["loop_seconds"] += time.perf_counter() - start
+            await asyncio.sleep(0)
+            batch_users = 0
+            start = time.perf_counter()
+    persistence_metrics["loop_seconds"] += time.perf_counter() - start
+    return snapshot
+
+def submit_persistence_task(function, *args):
+    """Runs a persistence function on the persistence thread and returns its future, with the result of the function,
+    or None if it raised. The persistence thread runs tasks in order, so writes never overtake each other."""
+    def run():
+        start = time.perf_counter()
         try:
-            with open(file, "w") as f:
-                json.dump(guild_data, f, cls=DateTimeEncoder)
-        except Exception as e:
-            print(f"[{datetime.now()}] Guild_data was not (completely) serializable. Tried to write to {file} instead.\nError:{e}")
-
-def is_jsonable(x):
-    """Checks if data X is json serializable."""
+            return function(*args)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            persistence_metrics["writer_seconds"] += time.perf_counter() - start
+    return persistence_executor.submit(run)
+
+def flush_guild_changes():
+    """Queues the records of all changed guilds and users to be appended to the journal in one write.
+    Only the changed records get written, so the cost of a write doesn't grow with the size of the database.
+    The journal gets compacted into guild_data.json once it grows past journal_compaction_ratio of the size of the snapshot,
+    so the cost of compactions per count stays the same no matter how large the database is.
+    Returns the future of the last queued write."""
+    global compaction_task
+    start = time.perf_counter()
+    records = []
+    for guild_id, user_ids in list(dirty_guilds.items()):
+        if guild_id in persistence_paused_guilds: # Stays dirty until the catch-up replay is complete
+            continue
+        del dirty_guilds[guild_id]
+        if compaction_flushed_guilds != None: # These changes can be newer than the copy of the guild in the snapshot
+            compaction_flushed_guilds.setdefault(guild_id, set()).update(user_ids)
+        guild = guild_data.get(guild_id)
+        if guild == None: # Guild doesn't exist anymore
+            continue
+        records.append({"guild_id": guild_id, "guild": guild.to_dict(False)})
+        for user_id in user_ids: # One record per changed user, the guild values are only written once
+            records.append({"guild_id": guild_id, "guild": {}, "user_id": user_id, "user": guild.users[user_id].to_dict()})
+    dirty_guilds_event.clear()
+    future = submit_persistence_task(append_journal_records, records)
+    persistence_metrics["flushes"] += 1
+    persistence_metrics["loop_seconds"] += time.perf_counter() - start
+    compaction_size = max(journal_compaction_minimum_size, journal_compaction_ratio * snapshot_size)
+    if journal_size >= compaction_size and (compaction_task == None or compaction_task.done()):
+        compaction_task = asyncio.get_running_loop().create_task(compact_guild_data())
+    return future
+
+def append_journal_records(records):
+    """Serializes journal records and appends them to the journal. Runs on the persistence thread."""
+    global journal_size
+    lines = []
+    for record in records:
+        try:
+            lines.append(json.dumps(record, cls=DateTimeEncoder))
+        except (TypeError, ValueError, OverflowError) as e:
+            print(f"[{datetime.now()}] {append_journal_records.__name__}: Record of guild {record['guild_id']} was not serializable.\nError:{e}")
+    if lines:
+        with open(guild_data_journal_file, "a") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            journal_size = f.tell()
+
+async def write_behind_loop():
+    """Background task that flushes changed guilds to the journal. Waits write_behind_latency seconds
+    after the first change, so that all changes made during a burst of counts are coalesced into one write."""
+    while True:
+        await dirty_guilds_event.wait()
+        await asyncio.sleep(write_behind_latency)
+        try:
+            await asyncio.wrap_future(flush_guild_changes())
+        except Exception:
+            traceback.print_exc()
+
+async def compact_guild_data():
+    """Writes a full snapshot of guild_data to guild_data.json, after which the journal gets emptied.
+    Changes flushed to the old journal while the snapshot was copied can be newer than the copy,
+    so those guilds and users are marked dirty again to also be flushed to the new journal."""
+    global guild_data_generation, compaction_flushed_guilds
+    flushed_guilds = compaction_flushed_guilds = {}
     try:
-        json.dumps(x, cls=DateTimeEncoder)
-        return True
-    except (TypeError, OverflowError):
-        return False
-
-def convert_keys_to_int(data):
-    """Converts all keys in a dictionary and its nested dictionaries or lists to integers."""
-    if isinstance(data, dict):
-        return {int(k) if k.isdigit() else k: convert_keys_to_int(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_keys_to_int(i) for i in data]
-    else:
-        return data
+        snapshot = await snapshot_guild_data()
+    finally:
+        compaction_flushed_guilds = None
+    guild_data_generation += 1
+    for guild_id, user_ids in flushed_guilds.items():
+        mark_guild_dirty(guild_id)
+        dirty_guilds[guild_id].update(user_ids)
+    await asyncio.wrap_future(submit_persistence_task(write_compacted_guild_data, snapshot, guild_data_generation))
+    print_persistence_metrics()
+
+def write_compacted_guild_data(snapshot, generation):
+    """Writes a snapshot to guild_data.json and starts a new, empty journal of the same generation.
+    The previous snapshot and journal are kept as backups.
+    The journal is only replaced once the snapshot is written, a snapshot that can't be serialized raises before
+    either file is touched, so the old snapshot and journal stay in use. Runs on the persistence thread."""
+    global journal_size, snapshot_size
+    file_content = serialize_guild_data(snapshot, generation)
+    rotate_backup_files(guild_data_file)
+    write_file_atomically(guild_data_file, file_content)
+    rotate_backup_files(guild_data_journal_file)
+    journal_header = f"{snapshot_header_prefix} generation={generation}\n"
+    write_file_atomically(guild_data_journal_file, journal_header)
+    snapshot_size = os.path.getsize(guild_data_file)
+    journal_size = len(journal_header)
+
+def rotate_backup_files(file):
+    """Keeps the current version of a file as its newest backup, file.bak.1, right before the file gets replaced.
+    Older backups shift up to file.bak.<snapshot_backup_amount>, older ones are overwritten. Runs on the persistence thread."""
+    if snapshot_backup_amount < 1 or not os.path.exists(file):
+        return
+    for number in range(snapshot_backup_amount - 1, 0, -1):
+        if os.path.exists(f"{file}.bak.{number}"):
+            os.replace(f"{file}.bak.{number}", f"{file}.bak.{number + 1}")
+    temp_file = f"{file}.bak.tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    try:
+        os.link(file, temp_file) # The file gets replaced by a rename, so a hard link keeps its contents without copying them
+    except OSError:
+        shutil.copy2(file, temp_file)
+    os.replace(temp_file, f"{file}.bak.1")
+
+def peak_memory_usage_string():
+    """Returns the peak resident memory of the process as a string, if the platform can report it."""
+    if resource == None:
+        return "peak memory usage unknown"
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin": # Linux reports kilobytes, macOS bytes
+        peak_rss *= 1024
+    return f"peak memory usage {peak_rss / 1024 / 1024:.1f} MiB"
+
+def print_persistence_metrics():
+    """Prints how much time persistence cost the event loop and the persistence thread."""
+    flushes = persistence_metrics["flushes"]
+    loop_ms = persistence_metrics["loop_seconds"] * 1000
+    writer_ms = persistence_metrics["writer_seconds"] * 1000
+    average_ms = loop_ms / flushes if flushes > 0 else 0
+    print(f"[{datetime.now()}] Persistence cost {loop_ms:.1f} ms of event loop time over {flushes} flush(es) " +
+          f"({average_ms:.3f} ms on average) and {writer_ms:.1f} ms of persistence thread time.")
+
+def write_guild_data(guild_data, backup=False, generation=0, schema_version=None):
+    """Writes the dictionary guild_data to guild_data.json, with a header containing its checksum, generation and schema
+    version, which is the current schema version if none is given. Optional backup parameter forces a backup filename format.
+    Raises a ValueError if guild_data can't be serialized, so callers don't carry on as if it was written."""
+    file = guild_data_file
+    if backup:
+        timestamp = format_current_datetime(datetime.now(), False, False)
+        file = f"{file}.bak{timestamp}"
+        if os.path.exists(file):
+            return # Stop backing up if file already exists
+    write_file_atomically(file, serialize_guild_data(guild_data, generation, schema_version))
+
+def serialize_guild_data(guild_data, generation=0, schema_version=None):
+    """Serializes the dictionary guild_data to the contents of a snapshot, with a header containing its checksum, generation
+    and schema version. Raises a ValueError if guild_data is not (completely) serializable."""
+    if schema_version == None:
+        schema_version = guild_data_schema_version
+    try:
+        file_content = json.dumps(guild_data, cls=DateTimeEncoder)
+    except (TypeError, ValueError, OverflowError) as e:
+        print(f"[{datetime.now()}] Guild_data was not (completely) serializable and was not written.\nError:{e}")
+        raise ValueError("Guild_data was not (completely) serializable.") from e
+    checksum = hashlib.sha256(file_content.encode()).hexdigest()
+    return f"{snapshot_header_prefix} sha256={checksum} generation={generation} schema={schema_version}\n{file_content}"
+
+def write_file_atomically(file, file_content):
+    """Writes to a temporary file, flushes it to the disk and renames it to the file.
+    A crash while writing leaves the old file intact instead of a truncated one."""
+    temp_file = f"{file}.tmp"
+    with open(temp_file, "w") as f:
+        f.write(file_content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, file)
+    try: # Also make the rename itself durable, which isn't supported on every platform
+        directory = os.open(os.path.dirname(os.path.abspath(file)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    except OSError:
+        pass
 #endregion
 
 #region Adding guilds/users to DB functions
-def update_values(update_dict, values, guild_id, user_id=None):
-    """Updates the given dictionary with new values, adds missing values, and deletes old values, for users or guilds."""
-    global guild_data
-    copy_guild_data = copy.deepcopy(guild_data)
-    added = 0
-    changed = 0
-    deleted = 0
+def migrate_guild_data(data, generation, schema_version):
+    """Upgrades the loaded guild_data dictionaries in place from their schema version to guild_data_schema_version,
+    by running every migration that's newer than the data. Backs up the data once before the first migration.
+    Runs on the persistence thread."""
+    if schema_version > guild_data_schema_version:
+        print(f"[{datetime.now()}] guild_data is of schema version {schema_version}, which is newer than the supported version {guild_data_schema_version}. It was loaded without migrating.")
+        return
+    if schema_version == guild_data_schema_version:
+        return
+    write_guild_data(data, True, generation, schema_version)
+    for version in range(schema_version, guild_data_schema_version):
+        start_time = time.perf_counter()
+        migration = guild_data_migrations[version]
+        result = migration(data)
+        print(f"[{datetime.now()}] Migrated guild_data from schema version {version} to {version + 1} in {time.perf_counter() - start_time:.2f} seconds: {result}")
+
+def migrate_to_current_values(data):
+    """Schema version 1: adds missing values, replaces values of which the type changed, and deletes old values of
+    all guilds and users. Settings are never replaced, as admins configured them. Also compresses previous_counts
+    that were stored as lists."""
+    guild_values = json.loads(json.dumps(GuildState().to_dict(), cls=DateTimeEncoder)) # Values like they are stored
+    user_values = UserState().to_dict()
+    changes = {"added": 0, "changed": 0, "deleted": 0}
+    for guild in data.values():
+        if isinstance(guild.get("previous_counts"), list): # Stored before previous counts were compressed
+            guild["previous_counts"] = encode_previous_counts(array("I", guild["previous_counts"]))
+        update_values(guild, guild_values, changes)
+        for user in guild["users"].values():
+            update_values(user, user_values, changes)
+    return f"added {changes['added']}, changed {changes['changed']}, and deleted {changes['deleted']} values."
+
+def update_values(update_dict, values, changes):
+    """Updates the given dictionary with new values, adds missing values, and deletes old values, for users or guilds.
+    Settings (values starting with s_) keep their configured value. Integers and floats are the same type, as
+    Discord passes float options that are whole numbers as integers. Counts the changes in the changes dictionary."""
     for k, v in values.items():
         if k not in update_dict: # New values get added
             update_dict[k] = v
-            added += 1
+            changes["added"] += 1
+        elif k.startswith("s_") or is_number(update_dict[k]) and is_number(v):
+            continue
         elif v != None and type(update_dict[k]) != type(v): # Check for changed type and add if type changed, ignore None
             update_dict[k] = v
-            changed += 1
-    for k in update_dict.keys():
-        if k not in values: # Old values get deleted
-            del update_dict[k]
-            deleted += 1
-    if added > 0 or changed > 0 or deleted > 0:
-        full_text = f"Successfully added {added}, changed {changed}, and deleted {deleted} values "
-        if user_id == None:
-            full_text += f"for guild {guild_id}."
-        else:
-            full_text += f"for user {user_id} in guild {guild_id}."
-        print(f"[{datetime.now()}] {full_text}")
-        write_guild_data(copy_guild_data, True) # Force a backup because changes were made
-        write_guild_data(guild_data)
+            changes["changed"] += 1
+    for k in [k for k in update_dict if k not in values]: # Old values get deleted
+        del update_dict[k]
+        changes["deleted"] += 1
+
+def is_number(value):
+    """Checks if a value is an integer or a float, booleans are not numbers here."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+guild_data_migrations = [migrate_to_current_values] # The migration at index i upgrades guild_data from schema version i to i + 1
+guild_data_schema_version = len(guild_data_migrations) # Schema version of guild_data written by this version of ChadCounting
 
-def add_guild_to_guild_data(guild_id, update=False):
-    """Adds new guild to guild_data dictionary, or adds/changes/deletes values corrosponding to new values."""
+def add_guild_to_guild_data(guild_id):
+    """Adds new guild to guild_data dictionary."""
     global guild_data
-    values = {"current_count": 0,
-              "highest_count": 0,
-              "previous_user": None,
-              "previous_message": None,
-              "counting_channel": None,
-              "users": {},
-              "previous_counts": [],
-              "s_correct_reaction": ["🙂"],
-              "s_incorrect_reaction": ["💀"],
-              "s_pass_doublecount": False,
-              "s_banning": True,
-              "s_minimum_ban": 1,
-              "s_maximum_ban": 120,
-              "s_ban_range": 1.1,
-              "s_troll_amplifier": 7}
     if guild_id not in guild_data: 
-        guild_data[guild_id] = values
+        guild_data[guild_id] = GuildState()
         print(f"[{datetime.now()}] New guild {guild_id} successfully added to dictionary.")
-        write_guild_data(guild_data)
-    elif update:
-        update_values(guild_data[guild_id], values, guild_id)
+        mark_guild_dirty(guild_id)
 
-def add_user_in_guild_data_json(user_id, guild_id, update=False):
-    """Adds new user to 'users' dictionary in guild_data, or adds/changes/deletes values corrosponding to new values."""
+def add_user_in_guild_data_json(user_id, guild_id):
+    """Adds new user to the users of a guild in guild_data."""
     global guild_data
-    values = {"time_banned": None,
-              "ban_time": 0,
-              "correct_counts": 0,
-              "incorrect_counts": 0}
-    if user_id not in guild_data[guild_id]["users"]:
-        guild_data[guild_id]["users"][user_id] = values 
+    if user_id not in guild_data[guild_id].users:
+        guild_data[guild_id].users[user_id] = UserState()
         (f"New user {user_id} successfully added to guild {guild_id}.")
-        write_guild_data(guild_data)
-    elif update:
-        update_values(guild_data[guild_id]["users"][user_id], values, guild_id, user_id)
+        mark_guild_dirty(guild_id, user_id)
+        update_global_user(guild_id, user_id)
 #endregion
 
 #region Banning helper functions
-def calculate_user_penalization(current_count, average_count, minimum_ban, maximum_ban, ban_range, troll_amplifier, message_count=""):
+def calculate_ban_curve(average_count, minimum_ban, maximum_ban, ban_range):
+    """Calculates the ban time of every count from 0 up to where the curve hits the maximum_ban time after the average
+    count, in one vectorized pass. The ban time grows exponentially with the distance from the average count,
+    and is at least the minimum_ban time and capped at the maximum_ban time. Range determines the width of the curve.
+    Used to render the chart of /banrate. Returns a numpy array where the index is the count, every later count gets the maximum_ban time."""
+    import numpy as np # Deferred import
+    # The curve hits maximum_ban at a distance of log(maximum_ban) / log(ban_range) from the average count
+    if ban_range > 1 and maximum_ban > 1:
+        max_distance = math.log(maximum_ban) / math.log(ban_range)
+    else:
+        max_distance = 0
+    end_count = max(math.floor(average_count) + 1, math.ceil(average_count + max_distance))
+    differences_from_average = np.abs(np.arange(end_count + 2) - average_count)
+    # Exponents past max_distance are capped, they already result in the maximum_ban time and would only overflow
+    ban_times = np.power(float(ban_range), np.minimum(differences_from_average, max_distance + 1))
+    ban_times = np.minimum(maximum_ban, np.maximum(minimum_ban, ban_times))
+    # Cut off at the count that's followed by a count above the average count and has the maximum_ban time (or is out of
+    # range when the settings don't allow for a curve), rounding can move the analytic end count by one
+    before_end = np.arange(len(ban_times)) + 1 > average_count
+    at_maximum = (ban_times < minimum_ban) | (ban_times >= maximum_ban)
+    last_counts = np.flatnonzero(before_end & at_maximum)
+    return ban_times[:last_counts[0] + 1] if len(last_counts) > 0 else ban_times
+
+def calculate_user_penalization(guild_id, current_count, average_count, message_count=""):
     """Calculates how long a user should be banned based on an exponential curve around the average count. 
-    The further the current count is from the average count, the higher the ban time will be. 
+    The further the current count is from the average count, the higher the ban time will be, like the chart of /banrate.
     The ban time will be at least the minimum_ban time and capped at the maximum_ban time.
-    Range determines the width of the exponential curve.
     Users who are off very much from the actual count (and probably trolling) will get penalized harder."""
+    guild = guild_data[guild_id]
     # Convert string of message into integer, or the current_count if no numbers are found
-    match = re.match(r'^\d+', message_count)
-    message_count_int = int(match.group()) if match else current_count
+    message_count_int = extract_number_from_string(message_count)
+    if message_count_int == None:
+        message_count_int = current_count
+    difference_from_current = abs(current_count - message_count_int)
+    if difference_from_current > 72 and current_count * 7 < message_count_int:
+        return guild.s_maximum_ban * guild.s_troll_amplifier # Penalize hard if the entered count is more than 7x or 72 off from the actual count
     # Math to calculate the ban time based on the average count and the current count
     difference_from_average = abs(current_count - average_count)
-    difference_from_current = abs(current_count - message_count_int)
     try:
-        minutes_ban = min(maximum_ban, max(minimum_ban, math.pow(ban_range, difference_from_average)))
+        return min(guild.s_maximum_ban, max(guild.s_minimum_ban, math.pow(guild.s_ban_range, difference_from_average)))
     except Exception:
-        minutes_ban = maximum_ban
-    if difference_from_current > 72 and current_count * 7 < message_count_int:
-        return maximum_ban * troll_amplifier # Penalize hard if the entered count is more than 7x or 72 off from the actual count
-    else:
-        return minutes_ban
+        return guild.s_maximum_ban
 
 def ban_user(user_id, guild_id, ban_time):
     """Bans a user in a certain guild for a certain amount of time. Returns True if successful."""
     global guild_data
-    if user_id in guild_data[guild_id]["users"]:
-        guild_data[guild_id]["users"][user_id]["time_banned"] = datetime.now()
-        guild_data[guild_id]["users"][user_id]["ban_time"] = ban_time
-        write_guild_data(guild_data)
+    if user_id in guild_data[guild_id].users:
+        guild_data[guild_id].users[user_id].time_banned = datetime.now()
+        guild_data[guild_id].users[user_id].ban_time = ban_time
+        mark_guild_dirty(guild_id, user_id)
         return True
     else:
         return False
 
 def check_user_banned(user_id, guild_id):
     """Checks if the user is still banned, and if so, returns the minutes of banned time."""
-    user_time_banned = guild_data[guild_id]["users"][user_id]["time_banned"]
+    user_time_banned = guild_data[guild_id].users[user_id].time_banned
     if user_time_banned != None:
         current_time = datetime.now()
         time_difference = current_time - user_time_banned
         minutes_passed = round(time_difference.total_seconds() / 60)
-        user_ban_time = guild_data[guild_id]["users"][user_id]["ban_time"]
+        user_ban_time = guild_data[guild_id].users[user_id].ban_time
         if minutes_passed > user_ban_time:
             return 0
         else:
@@ -545,16 +1465,20 @@ def message_count_to_string(message_count, suffix = False):
 
 #region Other helper functions
 def calculate_average_count_of_guild(guild_id):
-    """Calculates the mean of the previous_counts in a certain guild_id and returns 0 if there aren't any."""
-    previous_counts = guild_data[guild_id]["previous_counts"]
-    if len(previous_counts) > 0:
-        return statistics.mean(previous_counts)
+    """Returns the mean of the previous_counts in a certain guild_id from its running aggregates, or the exponentially
+    weighted mean if average_count_ewma is enabled. Returns 0 if there aren't any previous counts."""
+    guild = guild_data[guild_id]
+    if guild.previous_counts_amount > 0:
+        if average_count_ewma:
+            return guild.previous_counts_ewma
+        return guild.previous_counts_sum / guild.previous_counts_amount
     else:
         return 0
 
 def extract_discord_emoji(text):
     """Extracts unicode and custom emojis into a list, preserving order."""
     emoji_list = []
+    import emoji # Deferred import
     # Unicode emoji
     unicode_dict = emoji.emoji_list(text)
     for match in unicode_dict:
@@ -568,6 +1492,10 @@ def extract_discord_emoji(text):
     # Return just the emojis
     return [emoji[0] for emoji in emoji_list]
 
+def datetime_to_timestamp(date_time):
+    """Converts a naive or aware datetime to a POSIX timestamp that can be compared, or 0 if there is no datetime."""
+    return date_time.timestamp() if date_time != None else 0
+
 def format_current_datetime(date_time, timezone, spaces):
     """Formats a datetime to a readable string and returns it."""
     if not timezone and not spaces:
@@ -592,6 +1520,38 @@ def extract_number_from_string(string):
     else:
         return None
     
+async def resolve_user_names(user_ids, guild=None):
+    """Returns a dict with the names of users. Names come from the name cache or the gateway cache of the guild and bot
+    if possible, and the remaining users are fetched from the Discord API concurrently. Unknown users keep their ID."""
+    names = {}
+    missing_user_ids = []
+    now = time.monotonic()
+    for user_id in user_ids:
+        cached = user_name_cache.get(user_id)
+        if cached != None and cached[1] > now:
+            user_name_cache.move_to_end(user_id)
+            names[user_id] = cached
+            continue
+        user = guild.get_member(user_id) if guild != None else None
+        if user == None:
+            user = bot.get_user(user_id)
+        if user != None:
+            names[user_id] = user_name_cache[user_id] = (str(user), now + user_name_cache_ttl)
+            user_name_cache.move_to_end(user_id)
+        else:
+            missing_user_ids.append(user_id)
+    fetched_users = await asyncio.gather(*(bot.fetch_user(user_id) for user_id in missing_user_ids), return_exceptions=True)
+    for user_id, user in zip(missing_user_ids, fetched_users):
+        if isinstance(user, Exception):
+            print(f"[{datetime.now()}] Couldn't fetch the name of user {user_id}: {user}")
+            names[user_id] = (str(user_id), now) # Not cached, so it's tried again next time
+        else:
+            names[user_id] = user_name_cache[user_id] = (str(user), now + user_name_cache_ttl)
+            user_name_cache.move_to_end(user_id)
+    while len(user_name_cache) > user_name_cache_size:
+        user_name_cache.popitem(last=False)
+    return {user_id: name for user_id, (name, _) in names.items()}
+
 def escape_markdown(text):
     """Escapes special Discord Markdown characters in the given text."""
     escape_chars = ['*', '_', '~', '`']
@@ -608,17 +1568,80 @@ def adjust_font_size(title, max_font_size):
         title_width = len(title) * (font_size / max_font_size)
     return font_size
 
+def render_banrate_chart(average_count, minimum_ban, maximum_ban, ban_range, guild_name):
+    """Renders the chart of the ban times for every count of a guild and returns it as PNG bytes.
+    Runs on the chart thread. The figure isn't registered with pyplot, and is cleared once it's saved.
+    The chart holds no time, so it can be cached, the time of the request is shown in the embed instead."""
+    import numpy as np # Deferred imports
+    import matplotlib.image as mpimg
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg # Non-interactive backend, charts are only rendered to PNG files
+    global banrate_logo
+    ban_times = calculate_ban_curve(average_count, minimum_ban, maximum_ban, ban_range) # Ban levels starting at count 0
+    counts = np.arange(len(ban_times))
+    # Generate plot of ban times
+    fig = Figure(facecolor="#353840")
+    FigureCanvasAgg(fig)
+    try:
+        ax = fig.add_subplot()
+        ax.plot(counts, ban_times, linewidth=1.5, color="#FFFFFF")
+        ax.set_facecolor("#353840")
+        ax.set_xlabel("Count", fontsize=12, color="#FFFFFF")
+        ax.set_ylabel("Bantime (minutes)", fontsize=12, color="#FFFFFF")
+        title_text = f"ChadCounting banrate of {guild_name}"
+        ax.set_title(title_text, fontsize=adjust_font_size(title_text, 14), color="#FFFFFF")
+        ax.grid(color="#FFFFFF", alpha=0.5)
+        ax.spines["bottom"].set_color("#FFFFFF")
+        ax.spines["left"].set_color("#FFFFFF")
+        ax.spines["right"].set_color("#FFFFFF")
+        ax.spines["top"].set_color("#FFFFFF")
+        ax.tick_params(axis="both", colors="#FFFFFF", labelsize="10")
+        if banrate_logo is None:
+            banrate_logo = mpimg.imread("logo_chadcounting.png")
+        img_ax = fig.add_axes([0, 0, 0.12, 0.12])
+        img_ax.imshow(banrate_logo)
+        img_ax.axis("off")
+        # Generate image from plot
+        img = io.BytesIO()
+        fig.savefig(img, format="png")
+        return img.getvalue()
+    finally:
+        fig.clear()
+
 def remove_unavailable_emoji(emoji_list, default_emoji=None):
-    """Filter out custom emoji that the bot can't display, replace them with default emoji if there's no emoji left."""
+    """Returns a new list without the custom emoji that the bot can't display, or with the default emoji if there's no
+    emoji left. Custom emoji are returned as their discord.Emoji, so they can be sent without being looked up again."""
+    available_emoji = []
     for emoji in emoji_list:
         if emoji[0] == "<": # Custom Discord emoji start with <
-            emoji_id = int(re.search(r':\d+', emoji).group()[1:])
+            emoji_id = int(re.search(r':(\d+)>', emoji).group(1))
             loaded_emoji = bot.get_emoji(emoji_id) # Check if the bot can use it
-            if loaded_emoji == None:
-                emoji_list.remove(emoji) # Remove from list if not
-    if not emoji_list and default_emoji != None:
-        emoji_list.append(default_emoji)
-    return emoji_list
+            if loaded_emoji != None:
+                available_emoji.append(loaded_emoji)
+        else:
+            available_emoji.append(emoji)
+    if not available_emoji and default_emoji != None:
+        available_emoji.append(default_emoji)
+    return available_emoji
+
+def get_resolved_reactions(guild_id):
+    """Returns the correct and incorrect reactions of a guild that the bot can use, and resolves them if they were changed
+    or the emoji the bot can use were changed since they were last resolved."""
+    reactions = resolved_reactions.get(guild_id)
+    if reactions == None:
+        guild = guild_data[guild_id]
+        reactions = (remove_unavailable_emoji(guild.s_correct_reaction, "🙂"), remove_unavailable_emoji(guild.s_incorrect_reaction, "💀"))
+        resolved_reactions[guild_id] = reactions
+    return reactions
+
+def import_deferred_dependencies():
+    """Imports the heavy dependencies that aren't imported at startup, and returns how many seconds each import took."""
+    import_seconds = {}
+    for module_name in deferred_dependencies:
+        start_time = time.perf_counter()
+        importlib.import_module(module_name)
+        import_seconds[module_name] = time.perf_counter() - start_time
+    return import_seconds
 
 def chadcounting_embed(title, description=None):
     """Initialises an embed with the default ChadCounting settings."""
@@ -671,7 +1694,7 @@ async def command_exception(interaction, exception):
 async def check_correct_channel(interaction):
     """Checks if the command has been executed in the correct channel. Sends a response and returns False if not."""
     global guild_data
-    counting_channel = guild_data[interaction.guild.id]["counting_channel"]
+    counting_channel = guild_data[interaction.guild.id].counting_channel
     embed = chadcounting_embed("Incorrect channel")
     channel_error = f"You can only execute ChadCounting commands in the counting channel, "
     if counting_channel == None:
@@ -788,10 +1811,11 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
             if interaction.user.guild_permissions.administrator:
                 global guild_data
                 guild_id = interaction.guild.id
-                guild_data[guild_id]["counting_channel"] = interaction.channel_id
-                if guild_data[guild_id]["previous_message"] == None: # Set last message to now if no message has ever been recorded
-                    guild_data[guild_id]["previous_message"] = datetime.now()
-                write_guild_data(guild_data)
+                guild_data[guild_id].counting_channel = interaction.channel_id
+                update_counting_channel(guild_id)
+                if guild_data[guild_id].previous_message == None: # Set last message to now if no message has ever been recorded
+                    guild_data[guild_id].previous_message = datetime.now()
+                mark_guild_dirty(guild_id)
                 embed = chadcounting_embed("ChadCounting channel set")
                 embed.add_field(name="", value=f"The counting channel is now **'{interaction.channel}'**.")
             else:
@@ -828,12 +1852,12 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                 await interaction.response.send_message(embed=embed, ephemeral=True)
                 return
             if banning != None:
-                guild_data[guild_id]["s_banning"] = banning
+                guild_data[guild_id].s_banning = banning
             if minimum_ban != None:
                 if maximum_ban != None:
                     s_maximum_ban = maximum_ban
                 else:
-                    s_maximum_ban = guild_data[guild_id]["s_maximum_ban"]
+                    s_maximum_ban = guild_data[guild_id].s_maximum_ban
                 if minimum_ban < 0:
                     full_text = f"You can't set the minimum ban minutes lower than 0.{changes_string}"
                     embed.add_field(name="", value=full_text)
@@ -846,12 +1870,12 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                     await interaction.response.send_message(embed=embed, ephemeral=True)
                     return
                 else:
-                    guild_data[guild_id]["s_minimum_ban"] = minimum_ban
+                    guild_data[guild_id].s_minimum_ban = minimum_ban
             if maximum_ban != None:
                 if minimum_ban != None:
                     s_minimum_ban = minimum_ban
                 else:
-                    s_minimum_ban = s_maximum_ban = guild_data[guild_id]["s_minimum_ban"]
+                    s_minimum_ban = s_maximum_ban = guild_data[guild_id].s_minimum_ban
                 if maximum_ban < s_minimum_ban:
                     full_text = ("You can't set the maximum ban duration lower than the minimum ban duration.\n" +
                                 f"You tried to configure {s_minimum_ban} for the minimum duration and {maximum_ban} for the maximum duration.{changes_string}")
@@ -875,10 +1899,10 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                     elif view.button_answer == None: # Timeout, no button was pressed
                         return
                     else:
-                        guild_data[guild_id]["s_maximum_ban"] = maximum_ban
-                        write_guild_data(guild_data) # Write already because troll_amplifier can also be called later
+                        guild_data[guild_id].s_maximum_ban = maximum_ban
+                        mark_guild_dirty(guild_id) # Write already because troll_amplifier can also be called later
                 else:
-                    guild_data[guild_id]["s_maximum_ban"] = maximum_ban
+                    guild_data[guild_id].s_maximum_ban = maximum_ban
             if ban_range != None:
                 if ban_range < 1.001:
                     full_text = f"The banning range/width should be at least 1.001. You entered {ban_range}.{changes_string}"
@@ -886,7 +1910,7 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                     await interaction.response.send_message(embed=embed, ephemeral=True)
                     return
                 else:
-                    guild_data[guild_id]["s_ban_range"] = ban_range
+                    guild_data[guild_id].s_ban_range = ban_range
             if troll_amplifier != None:
                 if troll_amplifier >= 10:
                     view = ViewYesNoButtons(interaction)
@@ -909,23 +1933,23 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                     elif view.button_answer == None: # Timeout, no button was pressed
                         return
                     else:
-                        guild_data[guild_id]["s_troll_amplifier"] = troll_amplifier
+                        guild_data[guild_id].s_troll_amplifier = troll_amplifier
                 elif troll_amplifier < 1 or troll_amplifier > 1337:
                     full_text = f"You must enter a troll amplifier between 1 and 1337. You entered {troll_amplifier}.{changes_string}"
                     embed.add_field(name="", value=full_text)
                     await interaction.response.send_message(embed=embed, ephemeral=True)
                     return
                 else:
-                    guild_data[guild_id]["s_troll_amplifier"] = troll_amplifier
+                    guild_data[guild_id].s_troll_amplifier = troll_amplifier
             if pass_doublecount != None:
-                guild_data[guild_id]["s_pass_doublecount"] = pass_doublecount
+                guild_data[guild_id].s_pass_doublecount = pass_doublecount
             # Import settings and format text
-            s_banning = guild_data[guild_id]["s_banning"]
-            s_minimum_ban = minutes_to_fancy_string(guild_data[guild_id]["s_minimum_ban"])
-            s_maximum_ban = minutes_to_fancy_string(guild_data[guild_id]["s_maximum_ban"])
-            s_ban_range = guild_data[guild_id]["s_ban_range"]
-            s_troll_amplifier = guild_data[guild_id]["s_troll_amplifier"]
-            s_pass_doublecount = guild_data[guild_id]["s_pass_doublecount"]
+            s_banning = guild_data[guild_id].s_banning
+            s_minimum_ban = minutes_to_fancy_string(guild_data[guild_id].s_minimum_ban)
+            s_maximum_ban = minutes_to_fancy_string(guild_data[guild_id].s_maximum_ban)
+            s_ban_range = guild_data[guild_id].s_ban_range
+            s_troll_amplifier = guild_data[guild_id].s_troll_amplifier
+            s_pass_doublecount = guild_data[guild_id].s_pass_doublecount
             setting_string = (f"**Banning enabled:** {s_banning}\n" +
                             f"**Minimum ban duration:** {s_minimum_ban}\n" +
                             f"**Maximum ban duration:** {s_maximum_ban}\n" +
@@ -933,7 +1957,7 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                             f"**Troll amplifier:** {s_troll_amplifier}x\n" +
                             f"**Ignoring of double counts:** {s_pass_doublecount}")
             if configure:
-                write_guild_data(guild_data)
+                mark_guild_dirty(guild_id)
                 embed = chadcounting_embed(f"{interaction.user.name} changed the banning settings to the following")
                 embed.add_field(name="", value=setting_string)
                 if interaction.response.is_done(): # Check if last message needs to be a followup or normal response
@@ -969,20 +1993,19 @@ class SetCog(commands.GroupCog, name="set", description="Admins only: sets and c
                     response = await handle_reaction_setting(interaction, correct_reactions, embed)
                     if response == None: # None or incorrect amount of emoji
                         return
-                    guild_data[guild_id]["s_correct_reaction"] = response
+                    guild_data[guild_id].s_correct_reaction = response
                 if incorrect_reactions != None:
                     response = await handle_reaction_setting(interaction, incorrect_reactions, embed)
                     if response == None: # None or incorrect amount of emoji
                         return
-                    guild_data[guild_id]["s_incorrect_reaction"] = response
-                s_correct_reactions = guild_data[guild_id]["s_correct_reaction"]
-                s_incorrect_reactions = guild_data[guild_id]["s_incorrect_reaction"]
-                s_correct_reactions = remove_unavailable_emoji(s_correct_reactions, "🙂")
-                s_incorrect_reactions = remove_unavailable_emoji(s_incorrect_reactions, "💀")
+                    guild_data[guild_id].s_incorrect_reaction = response
+                if configure:
+                    resolved_reactions.pop(guild_id, None) # Resolve the new reactions
+                s_correct_reactions, s_incorrect_reactions = get_resolved_reactions(guild_id)
                 setting_string = (f"**Correct count reaction(s):** {''.join(str(i) for i in s_correct_reactions)}\n" +
                                 f"**Incorrect count reaction(s):** {''.join(str(i) for i in s_incorrect_reactions)}\n")
                 if configure:
-                    write_guild_data(guild_data)
+                    mark_guild_dirty(guild_id)
                     embed = chadcounting_embed(f"{interaction.user.name} changed ChadCounting's reactions to the following")
                     embed.add_field(name="", value=setting_string)
                     await interaction.response.send_message(embed=embed)
@@ -1003,7 +2026,7 @@ class CountCog(commands.GroupCog, name="count", description="Gives various count
         try:
             if not await check_bot_ready(interaction) or not await check_correct_channel(interaction):
                 return
-            current_count = guild_data[interaction.guild.id]["current_count"]
+            current_count = guild_data[interaction.guild.id].current_count
             embed = chadcounting_embed("Current count")
             embed.add_field(name="", value=f"The current count is **{current_count}**. So what should the next number be? That's up to you chads.")
             await interaction.response.send_message(embed=embed)
@@ -1016,10 +2039,10 @@ class CountCog(commands.GroupCog, name="count", description="Gives various count
             if not await check_bot_ready(interaction) or not await check_correct_channel(interaction):
                 return
             guild_id = interaction.guild.id
-            highest_count = guild_data[guild_id]["highest_count"]
-            current_count = guild_data[guild_id]["current_count"]
+            highest_count = guild_data[guild_id].highest_count
+            current_count = guild_data[guild_id].current_count
             average_count = round(calculate_average_count_of_guild(guild_id), 2)
-            amount_of_attempts = len(guild_data[guild_id]["previous_counts"])
+            amount_of_attempts = guild_data[guild_id].previous_counts_amount
             full_text = f"The high score is **{highest_count}**. "
             points = 0 # Points get calculated for the last suffix
             if highest_count > current_count:
@@ -1057,13 +2080,11 @@ async def banrate(interaction: discord.Integration):
             return
         # Define variables
         guild_id = interaction.guild.id
-        current_count = 0 # Start at calculating the count from 0
         average_count = calculate_average_count_of_guild(guild_id)
-        minimum_ban = guild_data[guild_id]["s_minimum_ban"]
-        maximum_ban = guild_data[guild_id]["s_maximum_ban"]
-        ban_range = guild_data[guild_id]["s_ban_range"]
-        troll_amplifier = guild_data[guild_id]["s_troll_amplifier"]
-        banning = guild_data[guild_id]["s_banning"]
+        minimum_ban = guild_data[guild_id].s_minimum_ban
+        maximum_ban = guild_data[guild_id].s_maximum_ban
+        ban_range = guild_data[guild_id].s_ban_range
+        banning = guild_data[guild_id].s_banning
         # Define text for message
         full_text = (
             "Banning is currently enabled, beware! Here's the current banrate, you chad. "
@@ -1072,45 +2093,24 @@ async def banrate(interaction: discord.Integration):
         )
         full_text += f"If you get banned at any later count than on the far right of the graph, you will get banned for {minutes_to_fancy_string(maximum_ban)}. "
         full_text += "Use the command `/set banning` to see the currently configured banning settings."
-        # Calculate banning levels
-        counts = []
-        ban_times = []
-        current_level = maximum_ban / 2 # Arbritrary level to simulate a do/while loop
-        while current_count <= average_count or current_level >= minimum_ban and current_level < maximum_ban:
-            current_level = calculate_user_penalization(current_count, average_count, minimum_ban, maximum_ban, ban_range, troll_amplifier)
-            counts.append(current_count)
-            ban_times.append(current_level)
-            current_count += 1
-        # Generate plot of ban times
-        fig, ax = plt.subplots(facecolor="#353840")
-        ax.plot(counts, ban_times, linewidth=1.5, color="#FFFFFF")
-        ax.set_facecolor("#353840")
-        ax.set_xlabel("Count", fontsize=12, color="#FFFFFF")
-        ax.set_ylabel("Bantime (minutes)", fontsize=12, color="#FFFFFF")
-        title_text = f"ChadCounting banrate of {interaction.guild.name}"
-        ax.set_title(title_text, fontsize=adjust_font_size(title_text, 14), color="#FFFFFF")
-        ax.grid(color="#FFFFFF", alpha=0.5)
-        ax.spines["bottom"].set_color("#FFFFFF")
-        ax.spines["left"].set_color("#FFFFFF")
-        ax.spines["right"].set_color("#FFFFFF")
-        ax.spines["top"].set_color("#FFFFFF")
-        ax.tick_params(axis="both", colors="#FFFFFF", labelsize="10")
-        img = mpimg.imread("logo_chadcounting.png")
-        img_ax = fig.add_axes([0, 0, 0.12, 0.12])
-        img_ax.imshow(img)
-        img_ax.axis("off")
-        utc = pytz.UTC
-        timestamp = format_current_datetime(datetime.now(utc), True, True)
-        fig.text(0.98, 0.98, timestamp, ha="right", va="top", color="#FFFFFF", alpha=0.5, fontsize=8, transform=fig.transFigure)
-        # Generate image from plot and send to user
-        img = io.BytesIO()
-        plt.savefig(img, format="png")
-        img.seek(0)
-        timestamp = format_current_datetime(datetime.now(utc), True, False)
+        # Render the chart on the chart thread, or reuse it if nothing changed since it was last rendered
+        chart_key = (average_count, minimum_ban, maximum_ban, ban_range, interaction.guild.name)
+        png = banrate_chart_cache.get(chart_key)
+        if png == None:
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(chart_executor, render_banrate_chart, *chart_key)
+            banrate_chart_cache[chart_key] = png
+            while len(banrate_chart_cache) > banrate_chart_cache_size:
+                banrate_chart_cache.popitem(last=False)
+        banrate_chart_cache.move_to_end(chart_key)
+        img = io.BytesIO(png)
+        now = datetime.now(timezone.utc)
+        timestamp = format_current_datetime(now, True, False)
         # Send embed with image in it
         filename = f"ChadCounting-banrate-{guild_id}-{timestamp}.png"
         file = discord.File(img, filename)
         embed = chadcounting_embed("Banning rate")
+        embed.timestamp = now # Not drawn on the cached chart, which can be older than the request
         embed.add_field(name="", value=full_text)
         embed.set_image(url=f"attachment://{filename}")
         await interaction.response.send_message(file=file, embed=embed)
@@ -1137,24 +2137,28 @@ class StatsCog(commands.GroupCog, name="stats", description="Gives various count
                 user_id = user.id
                 username = user.name
                 username_mention = user.mention
-            if user_id not in guild_data[guild_id]["users"]:
+            if user_id not in guild_data[guild_id].users:
                 full_text = f"I can't give you the stats of {username_mention}, because they haven't participated in ChadCounting yet. Shame."
                 embed = chadcounting_embed(title="User statistics")
                 embed.add_field(name="", value=full_text)
                 await interaction.response.send_message(embed=embed)
             else:
                 # Define statistics
-                correct_counts = guild_data[guild_id]["users"][user_id]["correct_counts"]
-                incorrect_counts = guild_data[guild_id]["users"][user_id]["incorrect_counts"]
+                correct_counts = guild_data[guild_id].users[user_id].correct_counts
+                incorrect_counts = guild_data[guild_id].users[user_id].incorrect_counts
                 total_counts = correct_counts + incorrect_counts
                 if total_counts > 0:
                     percent_correct = round((correct_counts / (total_counts)) * 100, 2)
                 else:
                     percent_correct = "N/A"
-                active_in_guilds = 0
-                for values in guild_data.values():
-                    if user_id in values["users"]:
-                        active_in_guilds += 1
+                ranking = get_user_ranking(guild_id)
+                rank = ranking.rank(user_id)
+                global_user = get_global_user(user_id)
+                global_total_counts = global_user.correct_counts + global_user.incorrect_counts
+                if global_total_counts > 0:
+                    global_percent_correct = round((global_user.correct_counts / global_total_counts) * 100, 2)
+                else:
+                    global_percent_correct = "N/A"
                 thresholds = {99.5: "What an absolute gigachad.",
                               99: "Chad performance.",
                               95: "Not bad, not good.",
@@ -1170,7 +2174,9 @@ class StatsCog(commands.GroupCog, name="stats", description="Gives various count
                             f"**Incorrect counts:** {incorrect_counts}\n" + 
                             f"**Total counts:** {total_counts}\n" +
                             f"**Percent correct:** {percent_correct}%\n" +
-                            f"**Active in Discord servers:** {active_in_guilds}")
+                            f"**Rank in this server:** #{rank} of {len(ranking)}\n" +
+                            f"**Active in Discord servers:** {len(global_user.guild_ids)}\n" +
+                            f"**Total counts in all servers:** {global_total_counts} ({global_percent_correct}% correct)")
                 embed = chadcounting_embed(f"Here you go, the user statistics of {username}")
                 embed.add_field(name="", value=full_text)
                 embed.set_footer(text=chad_level)
@@ -1184,17 +2190,16 @@ class StatsCog(commands.GroupCog, name="stats", description="Gives various count
             if not await check_bot_ready(interaction) or not await check_correct_channel(interaction):
                 return
             guild_id = interaction.guild.id
-            users = guild_data[guild_id]["users"]
-            user_list = [(user_id, user_data["correct_counts"], user_data["incorrect_counts"]) for user_id, user_data in users.items()]
-            sorted_user_list = sorted(user_list, key=lambda x: (x[1] + x[2], x[1]), reverse=True)
+            users = guild_data[guild_id].users
             full_text = ""
-            for i, user in enumerate(sorted_user_list[:10]):
-                user_id, correct_counts, incorrect_counts = user
-                user_id = await bot.fetch_user(user_id)
+            top_user_ids = get_user_ranking(guild_id).top(10) # Sorted by total counts, then correct counts
+            user_names = await resolve_user_names(top_user_ids, interaction.guild)
+            for i, user_id in enumerate(top_user_ids):
+                correct_counts = users[user_id].correct_counts
+                incorrect_counts = users[user_id].incorrect_counts
                 total_counts = correct_counts + incorrect_counts
-                if total_counts > 0:
-                    percent_correct = round((correct_counts / (total_counts)) * 100, 2)
-                full_text += f"**{i+1}. {user_id}**{total_counts} total counts ({percent_correct}% correct) {correct_counts} correct and {incorrect_counts} incorrect counts\n"
+                percent_correct = round((correct_counts / (total_counts)) * 100, 2) if total_counts > 0 else 0
+                full_text += f"**{i+1}. {user_names[user_id]}**{total_counts} total counts ({percent_correct}% correct) {correct_counts} correct and {incorrect_counts} incorrect counts\n"
             if len(full_text) > 0:
                 embed = chadcounting_embed("Here you go, the server statistics")
                 embed.add_field(name="", value=full_text)
@@ -1210,24 +2215,16 @@ class StatsCog(commands.GroupCog, name="stats", description="Gives various count
         try:
             if not await check_bot_ready(interaction) or not await check_correct_channel(interaction):
                 return
-            guild_ids_bot_is_in = {guild.id for guild in bot.guilds}
-            server_stats = [
-                (
-                    guild_id,
-                    guild_data[guild_id]["highest_count"],
-                    total_counts := sum(user_data["correct_counts"] + user_data["incorrect_counts"] for user_data in users["users"].values()),
-                    round((sum(user_data["correct_counts"] for user_data in users["users"].values()) / total_counts) * 100, 2) if total_counts > 0 else 0,
-                    guild_data[guild_id]["current_count"]
-                )
-                for guild_id, users in guild_data.items() if guild_id in guild_ids_bot_is_in
-            ]
-            # Sort by high score, then percent correct, then total counts
-            sorted_server_stats = sorted(server_stats, key=lambda x: (x[1], x[3], x[2]), reverse=True)[:10]
-            full_text = "\n".join(
-                f"**{i+1}. {escape_markdown(discord.utils.get(bot.guilds, id=guild_id).name)}**" +
-                f"Highest count: {highest_count}, total: {total_counts} ({percent_correct}% correct), current: {current_count}"
-                for i, (guild_id, highest_count, total_counts, percent_correct, current_count) in enumerate(sorted_server_stats)
-            )
+            # The leaderboard is sorted by high score, then percent correct, then total counts, and covers all shards
+            lines = []
+            for i, entry in enumerate(get_merged_leaderboard_top(10)):
+                highest_count, percent_correct, total_counts = entry["key"]
+                lines.append(f"**{i+1}. {escape_markdown(entry['name'])}**" +
+                             f"Highest count: {highest_count}, total: {total_counts} ({percent_correct}% correct), current: {entry['current_count']}")
+            full_text = "\n".join(lines)
+            rank, amount = get_merged_leaderboard_rank(interaction.guild.id)
+            if full_text and rank != None:
+                full_text += f"\n\nThis server is ranked **#{rank}** of {amount} servers."
             embed = chadcounting_embed("Here you go, the best servers on ChadCounting")
             embed.add_field(name="", value=full_text if full_text else "No servers have participated in ChadCounting yet. Shame. Start counting!")
             await interaction.response.send_message(embed=embed)
@@ -1235,6 +2232,55 @@ class StatsCog(commands.GroupCog, name="stats", description="Gives various count
             await command_exception(interaction, e)
 #endregion
 
+#region Sharding
+def guild_shard_id(guild_id):
+    """Returns the ID of the shard that receives the events of a guild, like Discord assigns them."""
+    return (guild_id >> 22) % shard_count
+
+async def shard_summary_loop():
+    """Background task of a sharded deployment that exchanges the summaries of the processes every shard_summary_interval
+    seconds, so the global views cover the guilds of all shards. A summary holds the guild count, the best guilds
+    and the sorted leaderboard keys of all guilds of a process."""
+    global shard_summaries
+    loop = asyncio.get_running_loop()
+    total_guild_count = None
+    while True:
+        try:
+            summary = {"shard_ids": shard_ids, "written_at": time.time(), "guild_count": len(bot.guilds),
+                       "top": [summarize_leaderboard_guild(guild_id) for guild_id in global_leaderboard.top(10)],
+                       "keys": [list(key) for key, _ in global_leaderboard.sorted_entries]}
+            shard_summaries = await loop.run_in_executor(persistence_executor, exchange_shard_summaries, summary)
+            if total_guild_count != get_total_guild_count():
+                total_guild_count = get_total_guild_count()
+                guild_count_push_event.set() # Sync guilds count of all shards with bot lists
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(shard_summary_interval)
+
+def exchange_shard_summaries(summary):
+    """Writes the summary of this process to the shard summary directory, and returns the recent summaries of the
+    other processes. Runs on the persistence thread."""
+    os.makedirs(shard_summary_directory, exist_ok=True)
+    own_file = os.path.join(shard_summary_directory, f"{shard_name}.json")
+    write_file_atomically(own_file, json.dumps(summary))
+    summaries = {}
+    for file in glob.glob(os.path.join(glob.escape(shard_summary_directory), "*.json")):
+        if file == own_file:
+            continue
+        try:
+            with open(file, "r") as f:
+                other_summary = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[{datetime.now()}] {exchange_shard_summaries.__name__}: Couldn't read {file}: {e}")
+            continue
+        if time.time() - other_summary["written_at"] > shard_summary_max_age:
+            continue # Stopped process
+        if set(other_summary["shard_ids"]) & set(shard_ids):
+            continue # Left behind by a process that ran some of the same shards before the shards were rearranged
+        summaries[file] = other_summary
+    return summaries
+#endregion
+
 #region APIs
 def discordbotlist_api_authorization_header():
     """Base headers for the Discordbotlist API"""
@@ -1250,36 +2296,117 @@ def generic_api_authorization_header(token):
         "Content-Type": "application/json"
     }
 
-def push_commands_to_discordbotlist():
+async def post_to_api(url, headers, payload):
+    """Posts a JSON payload to a bot website with the pooled session, and retries with exponential backoff if the request
+    fails, times out or the website is unavailable. Returns the status code of the last response, or None if there was none."""
+    status = None
+    for attempt in range(api_retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(api_retry_backoff * 2 ** (attempt - 1))
+        try:
+            async with api_session.post(url, headers=headers, json=payload) as response:
+                status = response.status
+            if status != 429 and status < 500: # Only rate limits and server errors are worth retrying
+                break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"[{datetime.now()}] {post_to_api.__name__}: {url} attempt {attempt + 1} failed: {e!r}")
+    return status
+
+def is_main_shard_process():
+    """Returns if this process runs shard 0, or all shards. Only that process pushes to the bot websites."""
+    return shard_ids == None or 0 in shard_ids
+
+def get_total_guild_count():
+    """Returns the amount of guilds of all shards, including the guilds in the summaries of the other processes."""
+    return len(bot.guilds) + sum(summary["guild_count"] for summary in shard_summaries.values())
+
+async def guild_count_push_loop():
+    """Background task that pushes the guild count to the bot websites when it changed, at most once every
+    guild_count_push_interval seconds, so that a burst of joined guilds is coalesced into one push."""
+    while True:
+        await guild_count_push_event.wait()
+        guild_count_push_event.clear()
+        try:
+            await push_guilds_count_to_all_bot_websites()
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(guild_count_push_interval)
+
+async def push_commands_to_discordbotlist():
     """Sends the bot's commands via the API."""
-    if check_dev_disable_apis(push_commands_to_discordbotlist.__name__): return
+    if check_dev_disable_apis(push_commands_to_discordbotlist.__name__) or not is_main_shard_process(): return
     url = f"{api_discordbotslist}/commands"
     headers = discordbotlist_api_authorization_header()
     # Convert list of commands to json-serializable and API-understandable format
     commands_list = []
     for command in get_all_commands(bot):
         commands_list.append({"name": command.qualified_name, "description": command.description})
-    response = requests.post(url, headers=headers, json=commands_list)
-    print(f"[{datetime.now()}] {push_commands_to_discordbotlist.__name__}: API response {response.status_code}.")
+    status = await post_to_api(url, headers, commands_list)
+    print(f"[{datetime.now()}] {push_commands_to_discordbotlist.__name__}: API response {status}.")
 
-def push_guilds_count_to_all_bot_websites():
-    """Pushes the current guild count to all bot websites configured."""
-    if check_dev_disable_apis(push_guilds_count_to_all_bot_websites.__name__): return
+async def push_guilds_count_to_all_bot_websites():
+    """Pushes the current guild count to all bot websites configured at the same time."""
+    if check_dev_disable_apis(push_guilds_count_to_all_bot_websites.__name__) or not is_main_shard_process(): return
     discordbotlist_headers = discordbotlist_api_authorization_header()
     topgg_headers = generic_api_authorization_header(TOPGG_TOKEN)
     discords_headers = generic_api_authorization_header(DISCORDS_TOKEN)
     discordbotsgg_headers = generic_api_authorization_header(DISCORDBOTSGG_TOKEN)
-    push_guilds_count_to_bot_website(f"{api_discordbotslist}/stats", "guilds", discordbotlist_headers)
-    push_guilds_count_to_bot_website(f"{api_topgg}/stats", "server_count", topgg_headers)
-    push_guilds_count_to_bot_website(api_discords, "server_count", discords_headers)
-    push_guilds_count_to_bot_website(f"{api_discordbotsgg}/stats", "guildCount", discordbotsgg_headers)
+    await asyncio.gather(
+        push_guilds_count_to_bot_website(f"{api_discordbotslist}/stats", "guilds", discordbotlist_headers),
+        push_guilds_count_to_bot_website(f"{api_topgg}/stats", "server_count", topgg_headers),
+        push_guilds_count_to_bot_website(api_discords, "server_count", discords_headers),
+        push_guilds_count_to_bot_website(f"{api_discordbotsgg}/stats", "guildCount", discordbotsgg_headers))
 
-def push_guilds_count_to_bot_website(url, payload_string, headers):
+async def push_guilds_count_to_bot_website(url, payload_string, headers):
     """Sends the number of guilds via the API."""
-    payload = {payload_string: len(bot.guilds)}
-    response = requests.post(url, headers=headers, json=payload)
-    print(f"[{datetime.now()}] {push_guilds_count_to_bot_website.__name__}: {url} API response {response.status_code}.")
+    payload = {payload_string: get_total_guild_count()}
+    status = await post_to_api(url, headers, payload)
+    print(f"[{datetime.now()}] {push_guilds_count_to_bot_website.__name__}: {url} API response {status}.")
+#endregion
+
+#region Benchmarks
+def benchmark_state_memory(guild_amount=10000, users_per_guild=1000):
+    """Compares the memory of guild_data stored as nested dictionaries and as GuildState and UserState records.
+    Run with: python bot.py --benchmark-memory [guild_amount] [users_per_guild]"""
+    def build_dicts():
+        data = {}
+        for guild_id in range(guild_amount):
+            guild = GuildState().to_dict()
+            guild["users"] = {user_id: UserState(correct_counts=user_id).to_dict() for user_id in range(users_per_guild)}
+            data[guild_id] = guild
+        return data
+    def build_records():
+        data = {}
+        for guild_id in range(guild_amount):
+            guild = GuildState()
+            guild.users = {user_id: UserState(correct_counts=user_id) for user_id in range(users_per_guild)}
+            data[guild_id] = guild
+        return data
+    print(f"Memory of {guild_amount} guild(s) with {users_per_guild} user(s) each:")
+    results = {}
+    for name, build in (("Nested dictionaries", build_dicts), ("Slotted records", build_records)):
+        tracemalloc.start()
+        data = build()
+        results[name] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del data
+        print(f"{name}: {results[name] / 1024 / 1024:.1f} MiB")
+    print(f"Slotted records use {results['Slotted records'] / results['Nested dictionaries'] * 100:.1f}% of the memory.")
+
+def benchmark_startup():
+    """Measures how long it takes to import bot.py, and how long the deferred dependencies would have added to that.
+    The time until the bot is ready is printed by on_ready on every start. Run with: python bot.py --benchmark-startup"""
+    print(f"Importing bot.py took {time.perf_counter() - process_start_time:.3f} seconds.")
+    import_seconds = import_deferred_dependencies()
+    for module_name, seconds in import_seconds.items():
+        print(f"{module_name}: {seconds:.3f} seconds")
+    print(f"Deferring these imports saves {sum(import_seconds.values()):.3f} seconds of the cold start.")
 #endregion
 
-bot.run(BOT_TOKEN)
+if "--benchmark-memory" in sys.argv:
+    benchmark_state_memory(*(int(arg) for arg in sys.argv[sys.argv.index("--benchmark-memory") + 1:]))
+elif "--benchmark-startup" in sys.argv:
+    benchmark_startup()
+else:
+    bot.run(BOT_TOKEN)
 # Coded by https://github.com/Gitfoe
\ No newline at end of file